@@ -1,39 +1,44 @@
 #!/usr/bin/python
 import nuphase
+import align_xcorr
+import bringup
 import time
 import numpy
 
 NUM_TRIES = 10
+DATA_VALID_FAILED = 2 #exit status if the ADC data valid flags never come up (0: not aligned, 1: aligned)
 verbose=True
 align_status_file = '/home/nuphase/nuphase_python/output/align_status'
 check_align_file  = '/home/nuphase/nuphase_python/output/align_check'
 
 def init(verbose=verbose, reset_shift_bytes=True):
-    sys = nuphase.Nuphase()
+    sys = nuphase.Nuphase(dualBoard=True) #aligns master and slave
     sys.boardInit(verbose=verbose)
     current_atten_values = sys.getCurrentAttenValues(verbose=True)
-    sys.setAttenValues(numpy.zeros(10, dtype=int), readback=verbose)
+    sys.setAttenValues(numpy.zeros(sys.topology.num_channels, dtype=int), readback=verbose)
     sys.calPulser(True, readback=verbose) #turn on cal pulse feature
 
-    SHIFT_BYTES = numpy.zeros(10, dtype=int)
+    SHIFT_BYTES = numpy.zeros(sys.topology.num_channels, dtype=int)
     if reset_shift_bytes:
-        #set to 0 and read in current values for delay:
-        ##master board
-        for i in range(4):
-            sys.write(sys.BUS_MASTER, [56+i,0,0,0])
-            readback = sys.readRegister(sys.BUS_MASTER, 56+i)
-            SHIFT_BYTES[2*i] = readback[3]
-            SHIFT_BYTES[2*i+1] = readback[2]
-        ##slave board
-        for i in range(1):
-            sys.write(sys.BUS_SLAVE, [56+i,0,0,0])
-            readback = sys.readRegister(sys.BUS_SLAVE, 56+i)
-            SHIFT_BYTES[2*i+8] = readback[3]
-            SHIFT_BYTES[2*i+1+8] = readback[2]
+        #set to 0 and read in current values for delay, every ADC of every board:
+        for bus, reg, (chan_a, chan_b) in sys.topology.adcs():
+            sys.write(bus, [reg,0,0,0])
+            readback = sys.readRegister(bus, reg)
+            SHIFT_BYTES[chan_a] = readback[3]
+            SHIFT_BYTES[chan_b] = readback[2]
     
     return sys, SHIFT_BYTES, current_atten_values
 
-def getPeaks(data, mode=1, channels=[0,9]):
+def alignChannels(sys, only_master_board=False):
+    #[first, last] channel compared: every aligned channel in the topology, or the master board's
+    if only_master_board:
+        return [0, 2*sys.topology.board(sys.BUS_MASTER).aligned_adcs-1]
+    return [0, sys.topology.aligned_channels[-1]]
+
+def getPeaks(data, mode=1, channels=None):
+    #channels: [first, last], default every channel in data
+    if channels is None:
+        channels = [0, len(data)-1]
     location_of_peaks=[]
 
     #SHOULD MAKE THIS MORE CONFIGURABLE:
@@ -63,13 +68,11 @@ def getPeaks(data, mode=1, channels=[0,9]):
 def alignInit(sys):
     sys.boardInit()
     print 'checking ADC data good flags..'
-    while (sys.getDataValid() != (1,1) and sys.dualBoards):
-        time.sleep(1)
+    if not bringup.waitForDataValid(sys):
+        print 'ADC data not valid after', bringup.DATA_VALID_TIMEOUT, 's'
+        return False
     print '...good\n'
-    sys.boardInit()
-    sys.softwareTrigger()
-    sys.readSysEvent(save=False)
-    sys.boardInit()
+    return True
             
 def align(NUM_TRIES=10, only_master_board=False):
     sys, SHIFT_BYTES, current_atten_values = init()
@@ -77,7 +80,9 @@ def align(NUM_TRIES=10, only_master_board=False):
     DELAY_SLAVE_BY_CLKCYCLE = False
     DELAY_MASTER_BY_CLKCYCLE = False
 
-    alignInit(sys)
+    if not alignInit(sys):
+        close(sys, current_atten_values, verbose=verbose)
+        raise SystemExit(DATA_VALID_FAILED)
     
     for i in range(NUM_TRIES):
         sys.boardInit()  #only deal with buffer 0
@@ -86,10 +91,8 @@ def align(NUM_TRIES=10, only_master_board=False):
         time.sleep(0.001)
         data = sys.readSysEvent(save=False)
 
-        if only_master_board:
-            location_of_peaks = getPeaks(data, channels=[0,7])
-        else:
-            location_of_peaks = getPeaks(data)
+        channels = alignChannels(sys, only_master_board)
+        location_of_peaks = getPeaks(data, channels=channels)
 
         earliest_peak = min(location_of_peaks)
         earliest_peak_ch = numpy.argmin(location_of_peaks)
@@ -120,7 +123,7 @@ def align(NUM_TRIES=10, only_master_board=False):
 
         elif (latest_peak - earliest_peak) > 16:
             print 'applying clkcycle delay'
-            if earliest_peak_ch > 7:
+            if earliest_peak_ch >= sys.topology.board(sys.BUS_MASTER).num_channels:
                 DELAY_SLAVE_BY_CLKCYCLE = True
                 DELAY_MASTER_BY_CLKCYCLE = False
             else:
@@ -145,8 +148,11 @@ def align(NUM_TRIES=10, only_master_board=False):
             print location_of_peaks
             print 'sending reset...'
             sys.reset()
-            time.sleep(30)
-            alignInit(sys)
+            time.sleep(bringup.RESET_MIN_WAIT)
+            bringup.waitForBoard(sys)
+            if not alignInit(sys):
+                close(sys, current_atten_values, verbose=verbose)
+                raise SystemExit(DATA_VALID_FAILED)
             continue
             
         #otherwise, try to align
@@ -157,28 +163,23 @@ def align(NUM_TRIES=10, only_master_board=False):
                 print 'alignment successful: ', location_of_peaks
                 print 'SHIFT BYTES:', SHIFT_BYTES
             sys.readSysEvent(save=True, filename='output/test_alignment.dat') #save pulse event for verification
+            align_xcorr.saveShiftBytes(sys) #restore with -r on next boot
             close(sys, current_atten_values, verbose=verbose)
             return 1
 
         if verbose:
             print location_of_peaks, 'sample diff', latest_peak-earliest_peak
-        #system has 12 channels = 6 ADC shift values
-        for j in range(4):
-            shift_value = latest_peak+DELAY_MASTER_BY_CLKCYCLE*16-location_of_peaks[2*j]+1
+        #one shift value per ADC (2 channels) in the topology
+        for bus, reg, (chan_a, chan_b) in sys.topology.adcs():
+            if chan_b > channels[1]:
+                continue
+            delay_by_clkcycle = DELAY_MASTER_BY_CLKCYCLE if bus == sys.BUS_MASTER else DELAY_SLAVE_BY_CLKCYCLE
+            shift_value = latest_peak+delay_by_clkcycle*16-location_of_peaks[chan_a]+1
             if shift_value != 0:
                 #should be identical for both channels within an ADC
-                SHIFT_BYTES[2*j] = 0x00 | DELAY_MASTER_BY_CLKCYCLE << 5 | True << 4 | (shift_value & 0xF)
-                SHIFT_BYTES[2*j+1] = 0x00 | DELAY_MASTER_BY_CLKCYCLE << 5 | True << 4 | (shift_value & 0xF)
-                sys.write(sys.BUS_MASTER, [56+j,0,SHIFT_BYTES[2*j+1], SHIFT_BYTES[2*j]])
-
-        if not only_master_board:
-            for j in range(1):
-                shift_value = latest_peak+DELAY_SLAVE_BY_CLKCYCLE*16-location_of_peaks[2*j+8]+1
-                if shift_value != 0:
-                    #should be identical for both channels within an ADC
-                    SHIFT_BYTES[2*j+8] = 0x00 | DELAY_SLAVE_BY_CLKCYCLE << 5 | True << 4 | (shift_value & 0xF)
-                    SHIFT_BYTES[2*j+1+8] = 0x00 | DELAY_SLAVE_BY_CLKCYCLE << 5 | True << 4 | (shift_value & 0xF)
-                    sys.write(sys.BUS_SLAVE, [56+j,0,SHIFT_BYTES[2*j+1+8],SHIFT_BYTES[2*j+8]])
+                SHIFT_BYTES[chan_a] = 0x00 | delay_by_clkcycle << 5 | True << 4 | (shift_value & 0xF)
+                SHIFT_BYTES[chan_b] = 0x00 | delay_by_clkcycle << 5 | True << 4 | (shift_value & 0xF)
+                sys.write(bus, [reg,0,SHIFT_BYTES[chan_b], SHIFT_BYTES[chan_a]])
 
     close(sys, current_atten_values, verbose=verbose)
     return 0
@@ -189,12 +190,14 @@ def close(sys, atten_values, verbose):
     sys.setAttenValues(atten_values, readback=verbose)
 
 
-def checkAlignment(channels=[0,9], NUM_TRIES=50, verbose=False):
+def checkAlignment(channels=None, NUM_TRIES=50, verbose=False, only_master_board=False):
     num_tests=0
     num_success=0
     num_almost_success=0
 
     sys, _, current_atten_values = init(reset_shift_bytes=False)
+    if channels is None:
+        channels = alignChannels(sys, only_master_board)
 
     for i in range(NUM_TRIES):
         sys.boardInit()  #only deal with buffer 0
@@ -247,6 +250,7 @@ def checkAlignment(channels=[0,9], NUM_TRIES=50, verbose=False):
 ##--------------------
 ##run >>python align_adcs.py            to align board timestreams
 ##run >>python align_adcs.py -c         to verify alignment
+##run >>python align_adcs.py -r         to restore saved alignment, re-aligning only if it fails verification
 if __name__=="__main__":
     import sys
     from optparse import OptionParser
@@ -254,6 +258,7 @@ if __name__=="__main__":
     parser = OptionParser()
     usage = "usage: %prog [options]"
     parser.add_option("-c", "--check", action="store_const", dest="check", const=True)
+    parser.add_option("-r", "--restore", action="store_const", dest="restore", const=True)
     parser.add_option("-m", "--master-only", action="store_const", dest="master", const=True)
     (options, args) = parser.parse_args()
 
@@ -263,7 +268,7 @@ if __name__=="__main__":
         #if len(sys.argv) == 3:
         #    num_tries = int(sys.argv[2])
         if options.master:
-            success, tests = checkAlignment(NUM_TRIES=num_tries, channels=[0,7])
+            success, tests = checkAlignment(NUM_TRIES=num_tries, only_master_board=True)
         else:
             success, tests = checkAlignment(NUM_TRIES=num_tries)
         file = open(check_align_file, 'w')
@@ -274,6 +279,12 @@ if __name__=="__main__":
         file = open(align_status_file, 'w')
         file.write("0")
         file.close()
+        #try saved shift bytes first, only do the full alignment if they fail verification
+        if options.restore and align_xcorr.restoreAlignment(nuphase.Nuphase(dualBoard=True)):
+            file = open(align_status_file, 'w')
+            file.write("1")
+            file.close()
+            sys.exit(1)
         if options.master:
             retval=align(only_master_board=True)
         else:
@@ -1,10 +1,12 @@
 #!/usr/bin/python
 import nuphase
+import align_xcorr
+import bringup
 import time
 import numpy
 
 NUM_TRIES = 10
-NUM_CHANNELS = 8
+DATA_VALID_FAILED = 2 #exit status if the ADC data valid flags never come up (0: not aligned, 1: aligned)
 verbose=True
 align_status_file = '/home/nuphase/nuphase_python/output/align_status'
 check_align_file  = '/home/nuphase/nuphase_python/output/align_check'
@@ -13,22 +15,24 @@ def init(verbose=verbose, reset_shift_bytes=True):
     sys = nuphase.Nuphase()
     sys.boardInit(verbose=verbose)
     current_atten_values = sys.getCurrentAttenValues(verbose=True)
-    sys.setAttenValues(numpy.zeros(NUM_CHANNELS, dtype=int), readback=verbose)
+    sys.setAttenValues(numpy.zeros(sys.topology.num_channels, dtype=int), readback=verbose)
     sys.calPulser(True, readback=verbose) #turn on cal pulse feature
 
-    SHIFT_BYTES = numpy.zeros(NUM_CHANNELS, dtype=int)
+    SHIFT_BYTES = numpy.zeros(sys.topology.num_channels, dtype=int)
     if reset_shift_bytes:
-        #set to 0 and read in current values for delay:
-        ##master board
-        for i in range(4):
-            sys.write(sys.BUS_MASTER, [56+i,0,0,0])
-            readback = sys.readRegister(sys.BUS_MASTER, 56+i)
-            SHIFT_BYTES[2*i] = readback[3]
-            SHIFT_BYTES[2*i+1] = readback[2]
+        #set to 0 and read in current values for delay, every ADC in the topology:
+        for bus, reg, (chan_a, chan_b) in sys.topology.adcs():
+            sys.write(bus, [reg,0,0,0])
+            readback = sys.readRegister(bus, reg)
+            SHIFT_BYTES[chan_a] = readback[3]
+            SHIFT_BYTES[chan_b] = readback[2]
     
     return sys, SHIFT_BYTES, current_atten_values
 
-def getPeaks(data, mode=1, channels=[0,7]):
+def getPeaks(data, mode=1, channels=None):
+    #channels: [first, last], default every channel in data
+    if channels is None:
+        channels = [0, len(data)-1]
     location_of_peaks=[]
 
     #SHOULD MAKE THIS MORE CONFIGURABLE:
@@ -56,18 +60,18 @@ def getPeaks(data, mode=1, channels=[0,7]):
 def alignInit(sys):
     sys.boardInit()
     print 'checking ADC data good flags..'
-    while (sys.getDataValid() != 1):
-        time.sleep(1)
+    if not bringup.waitForDataValid(sys):
+        print 'ADC data not valid after', bringup.DATA_VALID_TIMEOUT, 's'
+        return False
     print '...good\n'
-    sys.boardInit()
-    sys.softwareTrigger()
-    sys.readSysEvent(save=False)
-    sys.boardInit()
+    return True
             
 def align(NUM_TRIES=10):
     sys, SHIFT_BYTES, current_atten_values = init()
     
-    alignInit(sys)
+    if not alignInit(sys):
+        close(sys, current_atten_values, verbose=verbose)
+        raise SystemExit(DATA_VALID_FAILED)
     
     for i in range(NUM_TRIES):
         sys.boardInit()  #only deal with buffer 0
@@ -77,7 +81,7 @@ def align(NUM_TRIES=10):
         data = sys.readSysEvent(save=False)
 
 
-        location_of_peaks = getPeaks(data, channels=[0,7])
+        location_of_peaks = getPeaks(data)
 
         earliest_peak = min(location_of_peaks)
         earliest_peak_ch = numpy.argmin(location_of_peaks)
@@ -125,8 +129,11 @@ def align(NUM_TRIES=10):
             print location_of_peaks
             print 'sending reset...'
             sys.reset()
-            time.sleep(30)
-            alignInit(sys)
+            time.sleep(bringup.RESET_MIN_WAIT)
+            bringup.waitForBoard(sys)
+            if not alignInit(sys):
+                close(sys, current_atten_values, verbose=verbose)
+                raise SystemExit(DATA_VALID_FAILED)
             continue
             
         #otherwise, try to align
@@ -137,19 +144,20 @@ def align(NUM_TRIES=10):
                 print 'alignment successful: ', location_of_peaks
                 print 'SHIFT BYTES:', SHIFT_BYTES
             sys.readSysEvent(save=True, filename='output/test_alignment.dat') #save pulse event for verification
+            align_xcorr.saveShiftBytes(sys) #restore with -r on next boot
             close(sys, current_atten_values, verbose=verbose)
             return 1
 
         if verbose:
             print location_of_peaks, 'sample diff', latest_peak-earliest_peak
-        #system has 12 channels = 6 ADC shift values
-        for j in range(4):
-            shift_value = latest_peak - location_of_peaks[2*j]+1
+        #one shift value per ADC (2 channels) in the topology
+        for bus, reg, (chan_a, chan_b) in sys.topology.adcs():
+            shift_value = latest_peak - location_of_peaks[chan_a]+1
             if shift_value != 0:
                 #should be identical for both channels within an ADC
-                SHIFT_BYTES[2*j] = 0x00  | True << 4 | (shift_value & 0xF)
-                SHIFT_BYTES[2*j+1] = 0x00 | True << 4 | (shift_value & 0xF)
-                sys.write(sys.BUS_MASTER, [56+j,0,SHIFT_BYTES[2*j+1], SHIFT_BYTES[2*j]])
+                SHIFT_BYTES[chan_a] = 0x00  | True << 4 | (shift_value & 0xF)
+                SHIFT_BYTES[chan_b] = 0x00 | True << 4 | (shift_value & 0xF)
+                sys.write(bus, [reg,0,SHIFT_BYTES[chan_b], SHIFT_BYTES[chan_a]])
 
     
     close(sys, current_atten_values, verbose=verbose)
@@ -161,7 +169,7 @@ def close(sys, atten_values, verbose):
     sys.setAttenValues(atten_values, readback=verbose)
 
 
-def checkAlignment(channels=[0,7], NUM_TRIES=50, verbose=False):
+def checkAlignment(channels=None, NUM_TRIES=50, verbose=False):
     num_tests=0
     num_success=0
     num_almost_success=0
@@ -219,6 +227,7 @@ def checkAlignment(channels=[0,7], NUM_TRIES=50, verbose=False):
 ##--------------------
 ##run >>python align_adcs.py            to align board timestreams
 ##run >>python align_adcs.py -c         to verify alignment
+##run >>python align_adcs.py -r         to restore saved alignment, re-aligning only if it fails verification
 if __name__=="__main__":
     import sys
     from optparse import OptionParser
@@ -226,6 +235,7 @@ if __name__=="__main__":
     parser = OptionParser()
     usage = "usage: %prog [options]"
     parser.add_option("-c", "--check", action="store_const", dest="check", const=True)
+    parser.add_option("-r", "--restore", action="store_const", dest="restore", const=True)
     #parser.add_option("-m", "--master-only", action="store_const", dest="master", const=True)
     (options, args) = parser.parse_args()
 
@@ -246,6 +256,12 @@ if __name__=="__main__":
         file = open(align_status_file, 'w')
         file.write("0")
         file.close()
+        #try saved shift bytes first, only do the full alignment if they fail verification
+        if options.restore and align_xcorr.restoreAlignment(nuphase.Nuphase()):
+            file = open(align_status_file, 'w')
+            file.write("1")
+            file.close()
+            sys.exit(1)
         #if options.master:
         #    retval=align(only_master_board=True)
         #else:
@@ -0,0 +1,303 @@
+#!/usr/bin/python
+#
+# ADC alignment by cross-correlation of averaged cal-pulser events
+#
+# every channel is cross-correlated (FFT, zero-padded) against a reference channel,
+# event-by-event and all at once; the normalized correlations are averaged over
+# events and the peak is refined to sub-sample precision by a parabolic fit.
+# the resulting delays give the ADC shift bytes (registers 56-59) in one step,
+# along with a per-channel confidence: the fraction of single events whose own
+# correlation peak agrees with the averaged delay to within one sample
+#
+# >> ./align_xcorr.py           align (single pass, falls back to 2nd pass if confidence is low)
+# >> ./align_xcorr.py -c        fast alignment verification
+# >> ./align_xcorr.py -r        restore saved shift bytes, verify, and only re-align if verification fails
+#
+# verification reads only the RAM address window around the cal pulse, uses all 4 buffers
+# per cycle, and stops as soon as a Wilson confidence bound on the success fraction
+# clears (or falls below) the required pass fraction. the pulser is free-running: events
+# with no pulse in the window are not counted, and the window is located again when most
+# events of a batch miss it
+#
+import numpy
+import nuphase
+import noise
+import json
+import os
+import time
+
+NUM_EVENTS = 8
+MIN_CONFIDENCE = 0.7
+MAX_SHIFT = 31          #4-bit sample shift + one 16-sample clock-cycle delay
+SHIFT_REG_BASE = 56
+SAMPLES_PER_ADDRESS = 16
+WINDOW_PAD_ADDRESSES = 2
+PASS_FRACTION = 0.9     #required fraction of events with all ADC peaks on the same sample
+CONFIDENCE_Z = 2.       #width of the early-stopping bound, in sigma
+MAX_VERIFY_EVENTS = 100
+MULTI_PULSE_SPREAD = 300
+PULSE_SIGMA = 5.        #a channel sees the pulse if it peaks this many robust sigma above its median
+align_status_file = '/home/nuphase/nuphase_python/output/align_status'
+check_align_file  = '/home/nuphase/nuphase_python/output/align_check'
+shift_bytes_file  = '/home/nuphase/nuphase_python/output/shift_bytes.json'
+
+def adcMap(dev):
+    #(bus, shift register, (channel, channel)) for every ADC; channel index as in readSysEvent()
+    return dev.topology.adcs(SHIFT_REG_BASE)
+
+def crossCorrelate(data, ref_chan=0):
+    #data: (events, channels, samples). returns normalized correlation for every event,
+    #shape (events, channels, 2*samples) with lag k at index k (negative lags wrap to the end)
+    data = numpy.asarray(data, dtype=float)
+    data = data - data.mean(axis=2)[:,:,None]
+    num_samples = data.shape[2]
+    spectra = numpy.fft.rfft(data, n=2*num_samples, axis=2)
+    xcorr = numpy.fft.irfft(numpy.conj(spectra[:,ref_chan:ref_chan+1,:]) * spectra, n=2*num_samples, axis=2)
+    norm = numpy.sqrt((data**2).sum(axis=2) * (data[:,ref_chan:ref_chan+1,:]**2).sum(axis=2))
+    return xcorr / numpy.where(norm > 0, norm, 1.)[:,:,None]
+
+def peakLags(xcorr, max_lag=None):
+    #sub-sample lag of each channel's correlation peak (parabolic interpolation) and the peak height
+    num_lags = xcorr.shape[1]
+    lags = numpy.arange(num_lags)
+    lags = numpy.where(lags < num_lags // 2, lags, lags - num_lags)
+    if max_lag is not None:
+        xcorr = numpy.where(numpy.abs(lags)[None,:] <= max_lag, xcorr, -numpy.inf)
+    peak = numpy.argmax(xcorr, axis=1)
+    rows = numpy.arange(xcorr.shape[0])
+    y0 = xcorr[rows, (peak-1) % num_lags]
+    y1 = xcorr[rows, peak]
+    y2 = xcorr[rows, (peak+1) % num_lags]
+    denom = y0 - 2*y1 + y2
+    finite = numpy.isfinite(denom) & (denom != 0)
+    offset = numpy.where(finite, 0.5*(y0 - y2)/numpy.where(finite, denom, 1.), 0.)
+    return lags[peak] + offset, y1
+
+def channelDelays(data, ref_chan=0, max_lag=MAX_SHIFT):
+    #delay of each channel relative to ref_chan in samples (positive = later), and confidence
+    xcorr = crossCorrelate(data, ref_chan)
+    delays = peakLags(xcorr.mean(axis=0), max_lag)[0]
+    num_events, num_chan, num_lags = xcorr.shape
+    event_lags = peakLags(xcorr.reshape(num_events*num_chan, num_lags), max_lag)[0]
+    agree = numpy.abs(event_lags.reshape(num_events, num_chan) - delays[None,:]) <= 1.
+    return delays, agree.mean(axis=0)
+
+def shiftBytes(delays, confidence, adcs):
+    #per-ADC shift byte from channel delays: the latest ADC gets a shift of 1, earlier ones are
+    #delayed to match (same convention as align_adcs.align). returns (shift_bytes, adc_confidence)
+    adc_delay = numpy.array([delays[list(chans)].mean() for (bus, reg, chans) in adcs])
+    adc_confidence = numpy.array([confidence[list(chans)].min() for (bus, reg, chans) in adcs])
+    shift = numpy.round(adc_delay.max() - adc_delay).astype(int) + 1
+    if shift.max() > MAX_SHIFT:
+        return None, adc_confidence
+    shift_bytes = (shift >= 16) << 5 | 1 << 4 | (shift & 0xF)
+    return shift_bytes, adc_confidence
+
+def writeShiftBytes(dev, shift_bytes, adcs):
+    for j in range(len(adcs)):
+        bus, reg, chans = adcs[j]
+        dev.write(bus, [reg, 0, int(shift_bytes[j]), int(shift_bytes[j])])
+
+def resetShiftBytes(dev, adcs):
+    for bus, reg, chans in adcs:
+        dev.write(bus, [reg, 0, 0, 0])
+
+def boardState(dev, bus):
+    #identifies the configuration the shift bytes are valid for
+    firmware_version, firmware_date = dev.getFirmwareInfo(bus)
+    return {'dna' : '{:x}'.format(dev.dna()[bus]), 'firmware_version' : firmware_version, 'firmware_date' : firmware_date}
+
+def saveShiftBytes(dev, filename=shift_bytes_file):
+    #read back the shift registers of every board in use and save them with board DNA and firmware
+    boards = {}
+    for bus in sorted(set([adc[0] for adc in adcMap(dev)])):
+        regs = [adc[1] for adc in adcMap(dev) if adc[0] == bus]
+        boards[str(bus)] = boardState(dev, bus)
+        boards[str(bus)]['shift_regs'] = dict([(str(regs[i]), readback[1:]) for i, readback in enumerate(dev.readRegisters(bus, regs))])
+    with open(filename, 'w') as f:
+        json.dump({'time' : time.time(), 'boards' : boards}, f)
+    return boards
+
+def restoreShiftBytes(dev, filename=shift_bytes_file, verbose=True):
+    #write back saved shift bytes. returns False if there is no file, or the board DNA or firmware changed
+    if not os.path.isfile(filename):
+        return False
+    with open(filename, 'r') as f:
+        boards = json.load(f)['boards']
+    buses = sorted(set([adc[0] for adc in adcMap(dev)]))
+    for bus in buses:
+        saved = boards.get(str(bus))
+        current = boardState(dev, bus)
+        if saved is None or any([saved[key] != current[key] for key in current]):
+            if verbose:
+                print 'saved shift bytes do not match board on bus', bus, ', not restoring'
+            return False
+    for bus in buses:
+        for reg, value in boards[str(bus)]['shift_regs'].iteritems():
+            dev.write(bus, [int(reg)] + value)
+    if verbose:
+        print 'restored shift bytes from', filename
+    return True
+
+def restoreAlignment(dev, filename=shift_bytes_file, verbose=True):
+    #restore + quick verification. returns True if the restored alignment is good
+    dev.boardInit()
+    if not restoreShiftBytes(dev, filename, verbose=verbose):
+        return False
+    channels = [0, dev.topology.aligned_channels[-1]]
+    return verifyAlignment(dev, channels=channels, verbose=verbose)[3]
+
+def acquirePulserEvents(dev, num_events=NUM_EVENTS, address_start=1, address_stop=64):
+    dev.calPulser(True)
+    time.sleep(0.001)
+    return noise.acquireForcedEvents(dev, num_events, address_start, address_stop)
+
+def align(dev, num_events=NUM_EVENTS, min_confidence=MIN_CONFIDENCE, max_passes=2, verbose=True):
+    #returns (shift bytes or None, per-ADC confidence)
+    adcs = adcMap(dev)
+    current_atten_values = dev.getCurrentAttenValues()
+    dev.setAttenValues(numpy.zeros(len(current_atten_values), dtype=int), readback=False)
+    resetShiftBytes(dev, adcs)
+
+    shift_bytes = None
+    for i in range(max_passes):
+        data = acquirePulserEvents(dev, num_events)
+        delays, confidence = channelDelays(data)
+        shift_bytes, adc_confidence = shiftBytes(delays, confidence, adcs)
+        if verbose:
+            print 'pass', i, 'delays:', numpy.round(delays, 2).tolist()
+            print '      confidence:', numpy.round(adc_confidence, 2).tolist()
+        if shift_bytes is not None and adc_confidence.min() >= min_confidence:
+            break
+        #low confidence: try again with more events
+        shift_bytes = None
+        num_events = 2*num_events
+
+    if shift_bytes is not None:
+        writeShiftBytes(dev, shift_bytes, adcs)
+        saveShiftBytes(dev)
+        if verbose:
+            print 'SHIFT BYTES:', shift_bytes.tolist()
+
+    dev.boardInit()
+    dev.calPulser(False)
+    dev.setAttenValues(current_atten_values, readback=False)
+    return shift_bytes, adc_confidence
+
+def wilsonInterval(num_success, num_tests, z=CONFIDENCE_Z):
+    if num_tests == 0:
+        return 0., 1.
+    p = float(num_success) / num_tests
+    denom = 1. + z*z/num_tests
+    center = (p + z*z/(2.*num_tests)) / denom
+    half_width = z*numpy.sqrt(p*(1.-p)/num_tests + z*z/(4.*num_tests*num_tests)) / denom
+    return center - half_width, center + half_width
+
+def pulsePresent(data, channels):
+    #events in which every compared channel (first of each ADC, as in peakStatistics) sees a pulse
+    data = numpy.asarray(data[:, channels[0]:channels[1]+1:2, :], dtype=float)
+    deviation = data - numpy.median(data, axis=2)[:,:,None]
+    sigma = noise.MAD_TO_SIGMA * numpy.median(numpy.abs(deviation), axis=2)
+    return (deviation.max(axis=2) > PULSE_SIGMA * numpy.maximum(sigma, 1.)).all(axis=1)
+
+def pulseWindow(data, present=None, address_start=1, pad=WINDOW_PAD_ADDRESSES, address_max=64):
+    #RAM address range covering the cal pulse in every event of a full-readout batch.
+    #present: mask of the events to use (see pulsePresent); the full range if none has a pulse
+    if present is not None:
+        if not present.any():
+            return address_start, address_max
+        data = data[present]
+    envelope = numpy.abs(data - numpy.median(data, axis=2)[:,:,None]).sum(axis=1)
+    peak_address = address_start + numpy.argmax(envelope, axis=1) // SAMPLES_PER_ADDRESS
+    return max(address_start, peak_address.min() - pad), min(address_max, peak_address.max() + pad + 1)
+
+def peakStatistics(data, channels):
+    #vectorized over the batch: compare the peak sample of the first channel of every ADC
+    peaks = numpy.argmax(data[:, channels[0]:channels[1]+1:2, :], axis=2)
+    spread = peaks.max(axis=1) - peaks.min(axis=1)
+    #pulses at the window edges were clipped, treat like multiple pulses caught
+    edge = (peaks.min(axis=1) == 0) | (peaks.max(axis=1) == data.shape[2]-1)
+    valid = (spread <= MULTI_PULSE_SPREAD) & ~edge
+    return (valid & (spread == 0)).sum(), (valid & (spread == 1)).sum(), valid.sum()
+
+def verifyAlignment(dev, channels=[0,7], pass_fraction=PASS_FRACTION, max_events=MAX_VERIFY_EVENTS, verbose=True):
+    #returns (num_success, num_almost_success, num_tests, passed)
+    current_atten_values = dev.getCurrentAttenValues()
+    dev.setAttenValues(numpy.zeros(len(current_atten_values), dtype=int), readback=False)
+
+    #a full readout locates the pulse, afterwards only the window around it is read.
+    #events without a pulse are rejected; if most of a batch misses the window, locate it again
+    num_success, num_almost, num_tests, num_missed, num_events = 0, 0, 0, 0, 0
+    relocate = True
+    passed = None
+    while num_events < max_events:
+        if relocate:
+            data = acquirePulserEvents(dev, noise.NUM_BUFFERS)
+        else:
+            data = acquirePulserEvents(dev, noise.NUM_BUFFERS, address_start, address_stop)
+        present = pulsePresent(data, channels)
+        if relocate:
+            address_start, address_stop = pulseWindow(data, present)
+        success, almost, tests = peakStatistics(data[present], channels)
+        num_success, num_almost, num_tests = num_success+success, num_almost+almost, num_tests+tests
+        num_missed = num_missed + len(data) - present.sum()
+        num_events = num_events + noise.NUM_BUFFERS
+        relocate = 2*present.sum() < len(data)
+        low, high = wilsonInterval(num_success, num_tests)
+        if low >= pass_fraction:
+            passed = True
+            break
+        if high < pass_fraction:
+            passed = False
+            break
+    if passed is None:
+        passed = num_tests > 0 and float(num_success)/num_tests >= pass_fraction
+
+    dev.boardInit()
+    dev.calPulser(False)
+    dev.setAttenValues(current_atten_values, readback=False)
+    if verbose:
+        print 'read address window', address_start, '-', address_stop, 'over', num_events, 'events,', num_missed, 'without a pulse (not counted)'
+        print 'RESULTS:', num_success, 'pure successes out of', num_tests, 'tries'
+        print 'RESULTS:', num_success+num_almost, '>= almost successes (+/-1) out of', num_tests, 'tries'
+    return num_success, num_almost, num_tests, passed
+
+if __name__=='__main__':
+    import sys
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option("-c", "--check", action="store_const", dest="check", const=True)
+    parser.add_option("-r", "--restore", action="store_const", dest="restore", const=True)
+    (options, args) = parser.parse_args()
+
+    if options.check:
+        d=nuphase.Nuphase()
+        d.boardInit()
+        success, almost, tests, passed = verifyAlignment(d)
+        file = open(check_align_file, 'w')
+        file.write(str(success)+'\n'+str(tests))
+        file.close()
+        sys.exit(0)
+
+    file = open(align_status_file, 'w')
+    file.write("0")
+    file.close()
+
+    d=nuphase.Nuphase()
+    if options.restore and restoreAlignment(d):
+        file = open(align_status_file, 'w')
+        file.write("1")
+        file.close()
+        sys.exit(1)
+
+    d.boardInit()
+    shift_bytes, confidence = align(d)
+    if shift_bytes is None:
+        print 'problem here'
+        sys.exit(0)
+
+    file = open(align_status_file, 'w')
+    file.write("1")
+    file.close()
+    sys.exit(1)
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+#
+# station bring-up: reset -> board/data ready -> attenuation -> alignment -> thresholds
+#
+# stages run in dependency order; a stage is skipped if anything it depends on
+# failed or was skipped. readiness is found by polling the firmware registers
+# (DNA / firmware version, data-valid bit in register 8) instead of fixed sleeps,
+# and the time spent in each stage is written to timing_file
+#
+# >> ./bringup.py                    full bring-up
+# >> ./bringup.py -n                 no reset, just wait for ready and configure
+# >> ./bringup.py -t 5.0             also set thresholds predicted for 5.0 scaler counts/beam
+#
+import numpy
+import nuphase
+import align_xcorr
+import set_attenuation
+import threshold_model
+import json
+import time
+from tools.poll import pollUntil
+
+timing_file = '/home/nuphase/nuphase_python/output/bringup_timing.json'
+
+RESET_MIN_WAIT = 1.0    #give the reset time to take effect before trusting register reads
+READY_TIMEOUT = 60.
+DATA_VALID_TIMEOUT = 60.
+
+STAGES = [
+    #(name, depends on)
+    ('reset',       []),
+    ('board_ready', ['reset']),
+    ('data_valid',  ['board_ready']),
+    ('atten',       ['board_ready']),
+    ('align',       ['data_valid', 'atten']),
+    ('thresholds',  ['align']),
+    ]
+
+def buses(dev):
+    return dev.topology.buses
+
+def boardResponds(dev, bus):
+    #floating / unconfigured FPGA reads back all 0x00 or all 0xFF
+    version = dev.readRegister(bus, dev.map['FIRMWARE_VER'])
+    if version is None or version[1:] in ([0,0,0], [0xFF,0xFF,0xFF]):
+        return False
+    return dev.dna()[bus] not in (0, 0xFFFFFFFFFFFFFFFF)
+
+def waitForBoard(dev, timeout=READY_TIMEOUT):
+    return pollUntil(lambda: all([boardResponds(dev, bus) for bus in buses(dev)]), timeout)[0] is not None
+
+def dataValid(dev):
+    valid = dev.getDataValid()
+    return valid == 1 or valid == (1,1)
+
+def waitForDataValid(dev, timeout=DATA_VALID_TIMEOUT):
+    if pollUntil(lambda: dataValid(dev), timeout)[0] is None:
+        return False
+    #first event after ADC start-up is junk, flush it
+    dev.boardInit()
+    dev.softwareTrigger()
+    dev.readSysEvent(save=False)
+    dev.boardInit()
+    return True
+
+def stageReset(dev, options):
+    if not options.reset:
+        return True
+    dev.reset()
+    time.sleep(RESET_MIN_WAIT)
+    return True
+
+def stageAtten(dev, options):
+    load_attenuation = numpy.loadtxt(set_attenuation.atten_file)
+    dev.setAttenValues(numpy.array(load_attenuation[:,1], dtype=int), readback=False)
+    return True
+
+def stageAlign(dev, options):
+    if align_xcorr.restoreAlignment(dev, verbose=options.verbose):
+        return True
+    dev.boardInit()
+    return align_xcorr.align(dev, verbose=options.verbose)[0] is not None
+
+def stageThresholds(dev, options):
+    if options.target_rate is None:
+        return True
+    threshold_model.setThresholdsForRate(dev, options.target_rate)
+    return True
+
+STAGE_FUNCTIONS = {
+    'reset'       : stageReset,
+    'board_ready' : lambda dev, options: waitForBoard(dev),
+    'data_valid'  : lambda dev, options: waitForDataValid(dev),
+    'atten'       : stageAtten,
+    'align'       : stageAlign,
+    'thresholds'  : stageThresholds,
+    }
+
+def bringup(dev, options, stages=STAGES):
+    #returns {stage : {'status' : 'ok'/'failed'/'skipped', 'time' : seconds}}
+    results = {}
+    for name, depends in stages:
+        if any([results[dep]['status'] != 'ok' for dep in depends]):
+            results[name] = {'status' : 'skipped', 'time' : 0.}
+            continue
+        start = time.time()
+        try:
+            ok = STAGE_FUNCTIONS[name](dev, options)
+        except (IOError, TypeError) as e:
+            print name, 'error:', e
+            ok = False
+        results[name] = {'status' : 'ok' if ok else 'failed', 'time' : time.time() - start}
+        if options.verbose:
+            print '{:12s} {:8s} {:.2f} s'.format(name, results[name]['status'], results[name]['time'])
+    return results
+
+if __name__=='__main__':
+    import sys
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option("-n", "--no-reset", action="store_false", dest="reset", default=True)
+    parser.add_option("-t", "--target-rate", type="float", dest="target_rate", default=None)
+    parser.add_option("-q", "--quiet", action="store_false", dest="verbose", default=True)
+    (options, args) = parser.parse_args()
+
+    start = time.time()
+    d=nuphase.Nuphase()
+    results = bringup(d, options)
+    results['total'] = {'status' : 'ok', 'time' : time.time() - start}
+    with open(timing_file, 'w') as f:
+        json.dump(results, f)
+    print 'total bring-up time: {:.1f} s'.format(results['total']['time'])
+
+    sys.exit(0 if all([results[name]['status'] == 'ok' for name, depends in STAGES]) else 1)
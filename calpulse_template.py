@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#
+# averaged cal-pulser response template
+#
+# collects cal-pulser events through all 4 buffers, aligns each event to a reference
+# event with a sub-sample cross-correlation (common delay for all channels, so the
+# relative channel timing is kept), and accumulates the per-channel running mean and
+# variance in preallocated arrays. the result is saved so later timing / alignment
+# steps can load it instead of re-acquiring
+#
+# >> ./calpulse_template.py [num_events] [outfile]
+#
+import numpy
+import nuphase
+import noise
+import align_xcorr
+import time
+
+template_file = '/home/nuphase/nuphase_python/output/calpulse_template.npz'
+NUM_EVENTS = 64
+
+def eventDelays(data, reference):
+    #common delay (samples, sub-sample) of every event relative to reference, shape (events,)
+    data = data - data.mean(axis=2)[:,:,None]
+    reference = reference - reference.mean(axis=1)[:,None]
+    num_samples = data.shape[2]
+    spectra = numpy.fft.rfft(data, n=2*num_samples, axis=2)
+    ref_spectra = numpy.fft.rfft(reference, n=2*num_samples, axis=1)
+    xcorr = numpy.fft.irfft((numpy.conj(ref_spectra)[None,:,:] * spectra).sum(axis=1), n=2*num_samples, axis=1)
+    return align_xcorr.peakLags(xcorr, num_samples // 2)[0]
+
+def shiftEvents(data, delays):
+    #advance each event by its delay (fractional shifts via a Fourier phase ramp, zero-padded)
+    num_samples = data.shape[2]
+    freqs = numpy.fft.rfftfreq(2*num_samples)
+    phase = numpy.exp(2j*numpy.pi*freqs[None,:]*delays[:,None])
+    spectra = numpy.fft.rfft(data, n=2*num_samples, axis=2)
+    return numpy.fft.irfft(spectra * phase[:,None,:], n=2*num_samples, axis=2)[:,:,:num_samples]
+
+class TemplateBuilder():
+    def __init__(self, num_channels, num_samples):
+        self.count = 0
+        self.mean = numpy.zeros((num_channels, num_samples))
+        self.m2 = numpy.zeros((num_channels, num_samples))
+        self.reference = None
+
+    def add(self, data):
+        #data: (events, channels, samples). merges the batch into the running mean / variance
+        data = numpy.asarray(data, dtype=float)
+        if data.shape[0] == 0:
+            return
+        if self.reference is None:
+            self.reference = data[0].copy()
+        aligned = shiftEvents(data, eventDelays(data, self.reference))
+        batch_count = aligned.shape[0]
+        batch_mean = aligned.mean(axis=0)
+        batch_m2 = ((aligned - batch_mean[None,:,:])**2).sum(axis=0)
+        total = self.count + batch_count
+        delta = batch_mean - self.mean
+        self.mean += delta * batch_count / total
+        self.m2 += batch_m2 + delta**2 * self.count * batch_count / total
+        self.count = total
+
+    def variance(self):
+        return self.m2 / max(self.count - 1, 1)
+
+    def save(self, filename=template_file, **metadata):
+        if self.count == 0:
+            raise ValueError('no events accumulated, not saving an empty template')
+        numpy.savez(filename, mean=self.mean, variance=self.variance(), count=self.count, **metadata)
+
+def loadTemplate(filename=template_file):
+    #returns (mean, variance, count), each per channel
+    template = numpy.load(filename)
+    return template['mean'], template['variance'], int(template['count'])
+
+def buildTemplate(dev, num_events=NUM_EVENTS, filename=template_file, verbose=True):
+    if num_events < 1:
+        raise ValueError('a template needs at least one event, got num_events=%d' % num_events)
+    builder = None
+    for i in range(0, num_events, noise.NUM_BUFFERS):
+        data = align_xcorr.acquirePulserEvents(dev, min(noise.NUM_BUFFERS, num_events - i))
+        if builder is None:
+            builder = TemplateBuilder(data.shape[1], data.shape[2])
+        builder.add(data)
+        if verbose:
+            print builder.count, 'events accumulated'
+    dev.calPulser(False)
+    if filename is not None:
+        builder.save(filename, time=time.time(), dna=dev.dna()[0])
+    return builder
+
+if __name__=='__main__':
+    import sys
+
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_EVENTS
+    filename = sys.argv[2] if len(sys.argv) > 2 else template_file
+
+    d=nuphase.Nuphase()
+    d.boardInit()
+    buildTemplate(d, num_events, filename)
+    d.boardInit()
+    print 'saved template to', filename
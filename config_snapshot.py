@@ -0,0 +1,138 @@
+#!/usr/bin/python
+#
+# board configuration snapshot / diff / minimal-write restore
+#
+# >> ./config_snapshot.py save [file]      read all configuration registers of every board in use
+# >> ./config_snapshot.py diff [file]      show registers that differ from the snapshot
+# >> ./config_snapshot.py restore [file]   write back only the registers that differ
+# >> ./config_snapshot.py restore --force [file]   ...even if board DNA or firmware changed
+#
+import nuphase
+from bringup import buses
+import json
+import time
+
+snapshot_file = '/home/nuphase/nuphase_python/output/config_snapshot.json'
+SNAPSHOT_VERSION = 1
+
+ATTEN_REGISTERS = [50, 51, 52]
+ATTEN_LATCH = [53, 0, 0, 0]
+TRIGGER_REGISTERS = [82, 84, 85]
+#restore order matters: thresholds before the trigger enables
+CONFIG_REGISTERS = (
+    [nuphase.Nuphase.map['THRESHOLDS']+beam for beam in range(nuphase.NUM_BEAMS)] +
+    ATTEN_REGISTERS +
+    [56, 57, 58, 59] +    #ADC shift bytes
+    [76] +                #pre-trigger window
+    [75] +                #external trigger input config
+    TRIGGER_REGISTERS     #trigger enables
+    )
+
+def readConfig(dev, bus):
+    #{register : [byte1, byte2, byte3]}; byte 0 of the readback is not part of the value
+    readback = dev.readRegisters(bus, CONFIG_REGISTERS)
+    return dict([(reg, readback[i][1:]) for i, reg in enumerate(CONFIG_REGISTERS)])
+
+def boardState(dev, bus):
+    #identifies the board and firmware a snapshot was taken from
+    firmware_version, firmware_date = dev.getFirmwareInfo(bus)
+    return {'dna' : '{:x}'.format(dev.dna()[bus]), 'firmware_version' : firmware_version, 'firmware_date' : firmware_date}
+
+def snapshot(dev, filename=snapshot_file):
+    boards = {}
+    for bus in buses(dev):
+        boards[str(bus)] = boardState(dev, bus)
+        boards[str(bus)]['registers'] = dict([(str(reg), value) for reg, value in readConfig(dev, bus).iteritems()])
+    config = {'version' : SNAPSHOT_VERSION, 'time' : time.time(), 'boards' : boards}
+    if filename is not None:
+        with open(filename, 'w') as f:
+            json.dump(config, f, indent=1)
+    return config
+
+def load(filename=snapshot_file):
+    with open(filename, 'r') as f:
+        config = json.load(f)
+    if config.get('version') != SNAPSHOT_VERSION:
+        raise ValueError('unsupported snapshot version %s' % config.get('version'))
+    return config
+
+def diff(dev, config):
+    #list of (bus, register, current value, snapshot value) in restore order
+    differences = []
+    for bus in buses(dev):
+        saved = config['boards'].get(str(bus))
+        if saved is None:
+            continue
+        current = readConfig(dev, bus)
+        for reg in CONFIG_REGISTERS:
+            if str(reg) in saved['registers'] and current[reg] != saved['registers'][str(reg)]:
+                differences.append((bus, reg, current[reg], saved['registers'][str(reg)]))
+    return differences
+
+def mismatches(dev, config):
+    #buses whose board DNA or firmware differ from the snapshot
+    changed = []
+    for bus in buses(dev):
+        saved = config['boards'].get(str(bus))
+        if saved is None:
+            continue
+        current = boardState(dev, bus)
+        if any([saved.get(key) != current[key] for key in current]):
+            changed.append(bus)
+    return changed
+
+def restore(dev, config, force=False, verbose=True):
+    #write only the differing registers. returns the list of differences that were written,
+    #or None if a board or its firmware changed since the snapshot and force is not set
+    changed = mismatches(dev, config)
+    if len(changed) > 0:
+        if verbose:
+            print 'snapshot does not match board DNA / firmware on bus', changed,
+            print ', restoring anyway' if force else ', not restoring (use --force)'
+        if not force:
+            return None
+    differences = diff(dev, config)
+    latch = set()
+    #trigger enables go last, slave before master, inside one sync so the boards switch together
+    triggers = sorted([d for d in differences if d[1] in TRIGGER_REGISTERS], key=lambda d: d[0] == dev.BUS_MASTER)
+    for bus, reg, current, saved in [d for d in differences if d[1] not in TRIGGER_REGISTERS]:
+        dev.write(bus, [reg] + [int(b) for b in saved])
+        if reg in ATTEN_REGISTERS:
+            latch.add(bus)
+        if verbose:
+            print 'bus', bus, 'register', reg, ':', current, '->', saved
+    for bus in latch:
+        dev.write(bus, ATTEN_LATCH)
+    if len(triggers) > 0:
+        if dev.dualBoard:
+            dev.write(dev.BUS_MASTER, [39,0,0,1])
+        for bus, reg, current, saved in triggers:
+            dev.write(bus, [reg] + [int(b) for b in saved])
+            if verbose:
+                print 'bus', bus, 'register', reg, ':', current, '->', saved
+        if dev.dualBoard:
+            dev.write(dev.BUS_MASTER, [39,0,0,0])
+    if verbose:
+        print len(differences), 'registers restored'
+    return differences
+
+if __name__=='__main__':
+    import sys
+
+    force = '--force' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != '--force']
+    if len(args) < 1 or args[0] not in ['save', 'diff', 'restore']:
+        print 'usage: ./config_snapshot.py save|diff|restore [--force] [file]'
+        sys.exit(1)
+    filename = args[1] if len(args) > 1 else snapshot_file
+
+    d=nuphase.Nuphase(dualBoard=True)
+    if args[0] == 'save':
+        snapshot(d, filename)
+        print 'saved configuration to', filename
+    elif args[0] == 'diff':
+        for difference in diff(d, load(filename)):
+            print 'bus {} register {}: current {} snapshot {}'.format(*difference)
+    else:
+        if restore(d, load(filename), force=force) is None:
+            sys.exit(1)
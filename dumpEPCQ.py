@@ -0,0 +1,156 @@
+#!/usr/bin/python
+#
+# streaming EPCQ flash backup / audit
+#
+# reads an EPCQ address range in 16 KB blocks (see writeEPCQ.readEPCQBlock),
+# streams it to a file or compares it against one, and keeps a SHA-1 digest per 64 KB
+# sector. mismatches are summarized as address runs instead of one line per byte
+#
+# >> ./dumpEPCQ.py dump backup.rpd               back up the application image region
+# >> ./dumpEPCQ.py verify new.rpd                audit the flash against an .rpd file
+# >> ./dumpEPCQ.py dump full.bin -s 0 -l 0x2000000 -t slave
+#
+import nuphase
+import numpy
+import hashlib
+import json
+import mmap
+import sys
+import time
+import writeEPCQ
+import reconfigureFPGA as reconfig
+
+SECTOR_SIZE = writeEPCQ.SECTOR_SIZE
+BLOCK_SIZE = writeEPCQ.BLOCK_SIZE
+EPCQ_SIZE = 0x2000000 #EPCQ256
+MAX_RUNS_PRINTED = 16
+
+def readRange(dev, bus, start, length):
+    #generator of (address, uint8 array in file byte order), one 16 KB block at a time
+    for addr in range(start, start+length, BLOCK_SIZE):
+        data = writeEPCQ.fileOrder(writeEPCQ.readEPCQBlock(dev, bus, addr))
+        yield addr, data[:min(BLOCK_SIZE, start+length-addr)]
+
+def sectorDigests(dev, bus, start, length, blocks=None):
+    #SHA-1 of each 64 KB span of the range; blocks: iterable from readRange() (read here if None).
+    #returns [(sector address, digest)]
+    if blocks is None:
+        blocks = readRange(dev, bus, start, length)
+    digests = []
+    sector = None
+    for addr, data in blocks:
+        if sector is None or addr - sector >= SECTOR_SIZE:
+            if sector is not None:
+                digests.append((sector, digest.hexdigest()))
+            sector = addr
+            digest = hashlib.sha1()
+        digest.update(data.tobytes())
+    if sector is not None:
+        digests.append((sector, digest.hexdigest()))
+    return digests
+
+def mismatchRuns(offsets):
+    #collapse sorted mismatch offsets into [(first, last)] runs of consecutive bytes
+    offsets = numpy.asarray(offsets)
+    if len(offsets) == 0:
+        return []
+    breaks = numpy.flatnonzero(numpy.diff(offsets) > 1)
+    firsts = numpy.concatenate(([offsets[0]], offsets[breaks+1]))
+    lasts = numpy.concatenate((offsets[breaks], [offsets[-1]]))
+    return list(zip(firsts.tolist(), lasts.tolist()))
+
+def progress(addr, start, length, start_time):
+    if (addr - start) % (1 << 20) == 0:
+        sys.stdout.write('   0x{:x}: {:.2f} of {:.2f} MB, {:.0f} s   \r'.format(addr, (addr-start)*1e-6, length*1e-6, time.time()-start_time))
+        sys.stdout.flush()
+
+def dump(dev, bus, start, length, filename, verbose=True):
+    #stream the range to filename; per-sector digests go to filename + '.sha1.json'. returns the digests
+    start_time = time.time()
+    def blocks():
+        with open(filename, 'wb') as f:
+            for addr, data in readRange(dev, bus, start, length):
+                f.write(data.tobytes())
+                if verbose:
+                    progress(addr, start, length, start_time)
+                yield addr, data
+    digests = sectorDigests(dev, bus, start, length, blocks())
+    with open(filename + '.sha1.json', 'w') as f:
+        json.dump({'bus' : bus, 'start' : start, 'length' : length, 'time' : time.time(),
+                   'sectors' : [['0x{:x}'.format(sector), digest] for sector, digest in digests]}, f, indent=1)
+    if verbose:
+        print '\ndumped {:.2f} MB in {:.0f} s'.format(length*1e-6, time.time()-start_time)
+    return digests
+
+def verify(dev, bus, start, filename, file_offset=0, length=None, verbose=True):
+    #compare the flash from start against filename from file_offset. a length running past the
+    #end of the file is clamped to it: there is nothing to compare the rest of the flash against.
+    #returns ({sector address : mismatch count}, [(first, last) mismatching flash address runs], digests)
+    start_time = time.time()
+    with open(filename, 'rb') as binary_rpd_file:
+        rpd = mmap.mmap(binary_rpd_file.fileno(), 0, access=mmap.ACCESS_READ)
+        available = max(len(rpd) - file_offset, 0)
+        if length is None:
+            length = available
+        elif length > available:
+            if verbose:
+                print 'file ends 0x{:x} bytes before the requested range, not compared: 0x{:x} - 0x{:x}'.format(
+                    length-available, start+available, start+length-1)
+            length = available
+        sector_errors = {}
+        mismatches = []
+        def blocks():
+            for addr, data in readRange(dev, bus, start, length):
+                expected = numpy.frombuffer(rpd[file_offset+addr-start:file_offset+addr-start+len(data)], dtype=numpy.uint8)
+                bad = numpy.flatnonzero(data != expected)
+                if len(bad) > 0:
+                    mismatches.append(bad + addr)
+                    sector = addr - (addr - start) % SECTOR_SIZE
+                    sector_errors[sector] = sector_errors.get(sector, 0) + len(bad)
+                if verbose:
+                    progress(addr, start, length, start_time)
+                yield addr, data
+        digests = sectorDigests(dev, bus, start, length, blocks())
+        rpd.close()
+    runs = mismatchRuns(numpy.concatenate(mismatches)) if len(mismatches) > 0 else []
+    if verbose:
+        print '\nverified {:.2f} MB in {:.0f} s: {:d} byte mismatch(es) in {:d} sector(s)'.format(
+            length*1e-6, time.time()-start_time, sum(sector_errors.values()), len(sector_errors))
+        for first, last in runs[:MAX_RUNS_PRINTED]:
+            print '   0x{:x} - 0x{:x} ({:d} bytes)'.format(first, last, last-first+1)
+        if len(runs) > MAX_RUNS_PRINTED:
+            print '   ...', len(runs) - MAX_RUNS_PRINTED, 'more runs'
+    return sector_errors, runs, digests
+
+if __name__=='__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="usage: %prog dump|verify file [options]")
+    parser.add_option("-s", "--start", dest="start", default=None,
+                      help="EPCQ start address (hex), default: application image")
+    parser.add_option("-l", "--length", dest="length", default=None,
+                      help="bytes to read (hex), default: dump to the end of flash / verify the whole file")
+    parser.add_option("-t", "--target", dest="target", default="master", choices=["master", "slave"])
+    (options, args) = parser.parse_args()
+
+    if len(args) < 2 or args[0] not in ['dump', 'verify']:
+        parser.print_usage()
+        sys.exit(1)
+    start = writeEPCQ.TARGET_START_ADDR if options.start is None else int(options.start, 16)
+    length = None if options.length is None else int(options.length, 16)
+    if args[0] == 'dump' and length is None:
+        length = EPCQ_SIZE - start
+
+    dev=nuphase.Nuphase(dualBoard=(options.target == 'slave'))
+    bus = dev.BUS_SLAVE if options.target == 'slave' else dev.BUS_MASTER
+    reconfig.enableRemoteFirmwareBlock(dev, bus, False)
+    reconfig.enableRemoteFirmwareBlock(dev, bus, True)
+    writeEPCQ.forgetMode(bus)
+    retval = 0
+    if args[0] == 'dump':
+        dump(dev, bus, start, length, args[1])
+    else:
+        retval = 1 if len(verify(dev, bus, start, args[1], length=length)[0]) > 0 else 0
+    writeEPCQ.setMode(dev, bus, 0)
+    reconfig.enableRemoteFirmwareBlock(dev, bus, False)
+    sys.exit(retval)
@@ -0,0 +1,102 @@
+#
+# deadtime, livetime and throughput accounting for the acquisition loop
+#
+# usage in a readout loop:
+#     monitor = livetime.LivetimeMonitor()
+#     ...buffer flag seen...        monitor.bufferQueued(buf)
+#     ...before reading buffer...   monitor.startReadout(buf)
+#     metadata = dev.getMetaData()
+#     monitor.endReadout(buf, metadata)
+#     monitor.publish()             #rewrites the stats file every publish_interval seconds
+#
+import collections
+import json
+import os
+import time
+
+stats_file = '/home/nuphase/nuphase_python/output/daq_stats.json'
+
+DEADTIME_COUNTER_BITS = 24   #register 16
+EVENT_COUNTER_BITS = 48      #registers 10..13
+
+Sample = collections.namedtuple('Sample', ['time', 'trig_count', 'evt_count', 'deadtime', 'readout_time', 'queue_time'])
+
+def counterDelta(new, old, bits):
+    #difference of two free-running counters, allowing for one wrap-around
+    return (new - old) % (1 << bits)
+
+class LivetimeMonitor():
+    def __init__(self, filename=stats_file, window=60., publish_interval=10., board='master'):
+        self.filename = filename
+        self.window = window
+        self.publish_interval = publish_interval
+        self.board = board
+        self.samples = collections.deque()
+        self.queued = {}
+        self.readout_start = {}
+        self.start_time = time.time()
+        self.last_publish = 0
+        self.total_read = 0
+
+    def bufferQueued(self, buf, now=None):
+        #first time a full buffer is seen; only the earliest sighting counts
+        if buf not in self.queued:
+            self.queued[buf] = time.time() if now is None else now
+
+    def startReadout(self, buf):
+        self.readout_start[buf] = time.time()
+        self.bufferQueued(buf, self.readout_start[buf])
+
+    def endReadout(self, buf, metadata):
+        now = time.time()
+        start = self.readout_start.pop(buf, now)
+        queued = self.queued.pop(buf, start)
+        board_metadata = metadata[self.board]
+        self.samples.append(Sample(now, board_metadata['trig_count'], board_metadata['evt_count'],
+                                   board_metadata['deadtime'], now - start, start - queued))
+        self.total_read = self.total_read + 1
+        while len(self.samples) > 2 and (now - self.samples[0].time) > self.window:
+            self.samples.popleft()
+
+    def stats(self):
+        stats = {'time' : time.time(), 'uptime' : time.time() - self.start_time,
+                 'events_read' : self.total_read, 'window' : self.window}
+        if len(self.samples) < 2:
+            return stats
+        first = self.samples[0]
+        last = self.samples[-1]
+        elapsed = last.time - first.time
+        num_read = len(self.samples) - 1
+        triggers = counterDelta(last.trig_count, first.trig_count, EVENT_COUNTER_BITS)
+        events = counterDelta(last.evt_count, first.evt_count, EVENT_COUNTER_BITS)
+        deadtime = counterDelta(last.deadtime, first.deadtime, DEADTIME_COUNTER_BITS)
+        readout_times = [sample.readout_time for sample in self.samples]
+        queue_times = [sample.queue_time for sample in self.samples]
+
+        stats['events_per_sec'] = num_read / elapsed if elapsed > 0 else 0.
+        stats['triggers_per_sec'] = triggers / elapsed if elapsed > 0 else 0.
+        #fraction of triggers (and of firmware-recorded events) that made it off the board
+        stats['readout_fraction'] = float(num_read) / triggers if triggers > 0 else 1.
+        stats['event_fraction'] = float(num_read) / events if events > 0 else 1.
+        #raw firmware deadtime counter (register 16) over the window; its unit is not defined here
+        stats['deadtime_counts'] = deadtime
+        stats['deadtime_counts_per_sec'] = deadtime / elapsed if elapsed > 0 else 0.
+        stats['readout_time_mean'] = sum(readout_times) / len(readout_times)
+        stats['readout_time_max'] = max(readout_times)
+        stats['queue_time_mean'] = sum(queue_times) / len(queue_times)
+        stats['queue_time_max'] = max(queue_times)
+        #host busy fraction: time spent reading out vs. wall time in the window
+        stats['host_livetime'] = max(0., 1. - sum(readout_times[1:]) / elapsed) if elapsed > 0 else 1.
+        return stats
+
+    def publish(self, force=False):
+        now = time.time()
+        if not force and (now - self.last_publish) < self.publish_interval:
+            return None
+        self.last_publish = now
+        stats = self.stats()
+        tmp_filename = self.filename+'.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(stats, f)
+        os.rename(tmp_filename, self.filename)
+        return stats
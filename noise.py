@@ -0,0 +1,49 @@
+#
+# batched noise statistics from forced triggers
+#
+# acquireForcedEvents() fills the hardware buffers with software triggers and reads
+# them back as one (events, channels, samples) array; noiseStats() reduces that
+# array to per-channel mean, robust RMS and power spectrum in one pass
+#
+import numpy
+
+NUM_BUFFERS = 4
+MAD_TO_SIGMA = 1.4826  #MAD -> standard deviation for gaussian noise
+CLIP_SIGMA = 5.        #samples further than this from the median (in MAD sigma) are excluded from the RMS
+
+def acquireForcedEvents(dev, num_events=NUM_BUFFERS, address_start=1, address_stop=64):
+    data = None
+    for fill_start in range(0, num_events, NUM_BUFFERS):
+        num_fill = min(NUM_BUFFERS, num_events - fill_start)
+        dev.eventInit()
+        for i in range(num_fill):
+            dev.softwareTrigger()
+        for i in range(num_fill):
+            dev.setReadoutBuffer(i)
+            event = dev.readSysEvent(address_start=address_start, address_stop=address_stop, save=False)
+            if data is None:
+                data = numpy.empty((num_events, len(event), len(event[0])), dtype=numpy.int16)
+            data[fill_start+i] = event
+    dev.setReadoutBuffer(0)
+    return data
+
+def noiseStats(data, sample_rate=None):
+    #data: (events, channels, samples). statistics are pooled over events
+    data = numpy.asarray(data, dtype=float)
+    pooled = data.transpose(1, 0, 2).reshape(data.shape[1], -1)
+    stats = {}
+    stats['mean'] = pooled.mean(axis=1)
+    stats['std'] = pooled.std(axis=1)
+    #robust RMS: std after clipping outliers (glitches, stray pulses) found with the MAD.
+    #the MAD alone is too coarse on integer ADC counts at a few counts of noise
+    deviation = numpy.abs(pooled - numpy.median(pooled, axis=1)[:,None])
+    mad_sigma = MAD_TO_SIGMA * numpy.median(deviation, axis=1)
+    mad_sigma = numpy.where(mad_sigma > 0, mad_sigma, stats['std'])
+    clipped = numpy.where(deviation <= CLIP_SIGMA * mad_sigma[:,None], pooled, numpy.nan)
+    stats['rms'] = numpy.nanstd(clipped, axis=1)
+    #power spectrum per channel, each event baseline-subtracted, averaged over events
+    spectrum = numpy.abs(numpy.fft.rfft(data - data.mean(axis=2)[:,:,None], axis=2))**2
+    stats['spectrum'] = spectrum.mean(axis=0) / data.shape[2]
+    if sample_rate is not None:
+        stats['freqs'] = numpy.fft.rfftfreq(data.shape[2], 1./sample_rate)
+    return stats
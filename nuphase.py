@@ -5,12 +5,21 @@
 
 from Adafruit_BBIO import SPI
 import Adafruit_BBIO.GPIO as GPIO
+import numpy
 import math
 import time
 import os
+from topology import BEACON, NUPHASE
+from register_schema import SCHEMA, STATUS_FIELDS, METADATA_FIELDS, SCALER_FIELDS, NUM_BEAMS
 from tools.bf import *
+from tools.spi_message import SpiMessage, spidevFds, openedFd
 
-NUM_BEAMS = 24
+#write-verify policies for configuration registers (see Nuphase.writeVerified):
+#  'none'     - never read back
+#  'sampled'  - read back every verify_sample_every-th write immediately
+#  'deferred' - queue writes, verify them all in one batched read at verifyCheckpoint()
+#  'full'     - read back every write immediately
+VERIFY_POLICIES = ['none', 'sampled', 'deferred', 'full']
 
 class Nuphase():
     spi_bytes = 4  #transaction must include 4 bytes
@@ -31,20 +40,32 @@ class Nuphase():
         'THRESHOLDS'    : 0x80,
     }
         
-    def __init__(self, spi_clk_freq=10000000, dualBoard=False):
+    def __init__(self, spi_clk_freq=10000000, dualBoard=False, topology=None, verify_policy='none', verify_sample_every=16):
+        #topology describes the boards present (see topology.py); default follows dualBoard
         if not os.path.isfile('/sys/class/gpio/gpio60/value'):
             GPIO.setup("P9_12", GPIO.OUT) #enable pin for 2.5V bus drivers
             GPIO.output("P9_12", GPIO.LOW)  #enable for 2.5V bus drivers
         self.BUS_MASTER = 0
         self.BUS_SLAVE = 1
         self.spi={}
+        self.spi_message={} #multi-word messages on the same spidev descriptor, None if it can't be found
+        open_fds = spidevFds()
         self.spi[0]=SPI.SPI(self.BUS_MASTER,0) #setup SPI0
         self.spi[0].mode = 0
+        fd = openedFd(open_fds)
+        self.spi_message[0] = None if fd is None else SpiMessage(fd, self.spi_bytes)
     
+        open_fds = spidevFds()
         self.spi[1]=SPI.SPI(self.BUS_SLAVE,0)
         self.spi[1].mode = 0
-
-        self.dualBoard = dualBoard
+        fd = openedFd(open_fds)
+        self.spi_message[1] = None if fd is None else SpiMessage(fd, self.spi_bytes)
+
+        if topology is None:
+            topology = NUPHASE if dualBoard else BEACON
+        self.topology = topology
+        #master+slave pair; a lone board on either bus (single_board.py) is not dual-board
+        self.dualBoard = topology.hasBus(self.BUS_MASTER) and topology.hasBus(self.BUS_SLAVE)
         
         try:
             self.spi[0].msh = spi_clk_freq
@@ -54,6 +75,8 @@ class Nuphase():
 
         self.current_buffer = 0
         self.current_trigger= 0
+
+        self.setVerifyPolicy(verify_policy, verify_sample_every)
     
     def write(self, dev, data):
         if len(data) != 4:
@@ -62,6 +85,86 @@ class Nuphase():
             return None
         self.spi[dev].writebytes(data)        
 
+    def writeBurst(self, dev, words):
+        #write a list of 4-byte words, each in its own chip-select frame as with write().
+        #the words go to the kernel in SPI_IOC_MESSAGE batches (tools/spi_message.py), one
+        #ioctl per up to 511 words; without a spidev descriptor, one writebytes() per word
+        if dev < 0 or dev > 1:
+            return None
+        if self.spi_message[dev] is not None:
+            self.spi_message[dev].transfer(list(words))
+            return
+        spi = self.spi[dev]
+        for word in words:
+            spi.writebytes(word)
+
+    def pipeline(self, dev, words):
+        #send words in order; every SET_READ_REG word is followed by a read of the selected register.
+        #returns the readbacks as a uint8 array, shape (reads, 4). words and reads keep their own
+        #chip-select frames and go out as SPI_IOC_MESSAGE batches like writeBurst()
+        if dev < 0 or dev > 1:
+            return None
+        set_read_reg = self.map['SET_READ_REG']
+        if self.spi_message[dev] is not None:
+            frames = []
+            for word in words:
+                frames.append(word)
+                if word[0] == set_read_reg:
+                    frames.append(None)
+            return self.spi_message[dev].transfer(frames)
+        spi = self.spi[dev]
+        num_reads = sum([1 for word in words if word[0] == set_read_reg])
+        readback = numpy.empty((num_reads, self.spi_bytes), dtype=numpy.uint8)
+        k = 0
+        for word in words:
+            spi.writebytes(word)
+            if word[0] == set_read_reg:
+                readback[k] = spi.readbytes(self.spi_bytes)
+                k = k + 1
+        return readback
+
+    def setVerifyPolicy(self, policy='none', sample_every=16):
+        if policy not in VERIFY_POLICIES:
+            raise ValueError('verify policy must be one of %s' % VERIFY_POLICIES)
+        self.verify_policy = policy
+        self.verify_sample_every = sample_every
+        self.verify_count = 0
+        self.verify_pending = {}  #(bus, register) -> last written word
+        self.verify_errors = []
+
+    def writeVerified(self, dev, data):
+        #write a configuration register that reads back what was written, verifying per verify_policy
+        self.write(dev, data)
+        if self.verify_policy == 'none':
+            return
+        self.verify_count = self.verify_count + 1
+        if self.verify_policy == 'deferred':
+            self.verify_pending[(dev, data[0])] = list(data)
+        elif self.verify_policy == 'full' or self.verify_count % self.verify_sample_every == 0:
+            self.verify_errors.extend(self.compareReadback(dev, [list(data)]))
+
+    def compareReadback(self, dev, words):
+        #batched readback of written words; returns list of discrepancies
+        discrepancies = []
+        readback = self.readRegisters(dev, [word[0] for word in words])
+        for i in range(len(words)):
+            if [int(b) for b in readback[i][1:]] != [int(b) for b in words[i][1:]]:
+                discrepancies.append({'bus' : dev, 'register' : words[i][0],
+                                      'written' : [int(b) for b in words[i][1:]], 'readback' : readback[i][1:]})
+        return discrepancies
+
+    def verifyCheckpoint(self):
+        #verify every pending deferred write (one pipelined read per bus) and return all
+        #discrepancies found since the last checkpoint, including immediate/sampled ones
+        for bus in self.topology.buses:
+            words = [word for (word_bus, reg), word in sorted(self.verify_pending.items()) if word_bus == bus]
+            if len(words) > 0:
+                self.verify_errors.extend(self.compareReadback(bus, words))
+        self.verify_pending = {}
+        errors = self.verify_errors
+        self.verify_errors = []
+        return errors
+
     def read(self, dev):
         if dev < 0 or dev > 1:
             return None
@@ -77,44 +180,40 @@ class Nuphase():
 #        print readback
         return readback
 
-    def dna(self):
-        dna_bytes = 8
-        
-        dna_low_slave  = self.readRegister(self.BUS_SLAVE,4)[::-1] #lower 3 bytes 
-        dna_mid_slave  = self.readRegister(self.BUS_SLAVE,5)[::-1] #middle 3 bytes
-        dna_hi_slave   = self.readRegister(self.BUS_SLAVE,6)[::-1] #upper 2 bytes
-        dna_low_master = self.readRegister(self.BUS_MASTER,4)[::-1] #lower 3 bytes 
-        dna_mid_master = self.readRegister(self.BUS_MASTER,5)[::-1] #middle 3 bytes
-        dna_hi_master  = self.readRegister(self.BUS_MASTER,6)[::-1] #upper 2 bytes        
-
-        board_dna_slave = 0
-        board_dna_master = 0
-
-        for i in range(dna_bytes):
-            if i < 3:
-                board_dna_slave = board_dna_slave | (dna_low_slave[i] << i*8)
-                board_dna_master = board_dna_master | (dna_low_master[i] << i*8)
-            elif i < 6:
-                board_dna_slave = board_dna_slave | (dna_mid_slave[i-3] << i*8)
-                board_dna_master = board_dna_master | (dna_mid_master[i-3] << i*8)
-            else:
-                board_dna_slave = board_dna_slave | (dna_hi_slave[i-6] << i*8)
-                board_dna_master = board_dna_master | (dna_hi_master[i-6] << i*8)
-
-        return board_dna_master, board_dna_slave
+    def readRegisters(self, dev, addresses):
+        #read a set of registers as one SPI message (see pipeline). returns list of readbacks
+        if dev < 0 or dev > 1:
+            return None
+        for address in addresses:
+            if address > self.firmware_registers_adr_max-1 or address < 1:
+                return None
+        set_read_reg = self.map['SET_READ_REG']
+        return self.pipeline(dev, [[set_read_reg, 0x00, 0x00, address & 0xFF] for address in addresses]).tolist()
+
+    def dna(self, buses=None):
+        #returns (master, slave) board DNA; 0 for a bus with no board (or not in buses)
+        board_dna = [0, 0]
+
+        if buses is None:
+            buses = self.topology.buses
+        for bus in buses:
+            board_dna[bus] = SCHEMA.read(self, bus, ['dna'])['dna']
+
+        return board_dna[0], board_dna[1]
+
+    def getFirmwareInfo(self, bus=0):
+        fw = SCHEMA.read(self, bus, ['firmware_id', 'firmware_major', 'firmware_minor',
+                                     'firmware_year', 'firmware_month', 'firmware_day'])
+        firmware_version = [fw['firmware_id'], str(fw['firmware_major'])+'.'+str(fw['firmware_minor'])]
+        firmware_date = [fw['firmware_year'], fw['firmware_month'], fw['firmware_day']]
+        return firmware_version, firmware_date
 
     def identify(self):
         dna = self.dna()
-        for i in range(2):
-            if not self.dualBoard and i==1:
-                return
-            
+        for i in self.topology.buses:
             print "SPI bus", i
-            firmware_version = self.readRegister(i, self.map['FIRMWARE_VER'])
-            firmware_version = [firmware_version[1], str((firmware_version[3] & 0xF0)>>4)+'.'+str(firmware_version[3]&0x0F)]
+            firmware_version, firmware_date = self.getFirmwareInfo(i)
             print 'firmware version:', firmware_version
-            firmware_date = self.readRegister(i, self.map['FIRMWARE_DATE'])
-            firmware_date = [(firmware_date[1])<<4 | (firmware_date[2] & 0xF0)>>4, firmware_date[2] & 0x0F, firmware_date[3]]
             print 'firmware date:', firmware_date
             print 'board DNA:', hex(dna[i])
             print '-----------------------------------'
@@ -122,7 +221,8 @@ class Nuphase():
     def reset(self, sync=True):
         if sync:
             self.write(self.BUS_MASTER,[39,0,0,1])
-        self.write(self.BUS_SLAVE, [127,0,0,1])
+        if self.dualBoard:
+            self.write(self.BUS_SLAVE, [127,0,0,1])
         self.write(self.BUS_MASTER, [127,0,0,1])
         if sync:
             self.write(self.BUS_MASTER,[39,0,0,0])
@@ -137,7 +237,8 @@ class Nuphase():
     def resetADC(self, sync=True):
         if sync:
             self.write(self.BUS_MASTER,[39,0,0,1])
-        self.write(self.BUS_SLAVE, [127,0,0,4])
+        if self.dualBoard:
+            self.write(self.BUS_SLAVE, [127,0,0,4])
         self.write(self.BUS_MASTER, [127,0,0,4])
         if sync:
             self.write(self.BUS_MASTER,[39,0,0,0])
@@ -152,11 +253,13 @@ class Nuphase():
         self.bufferClear(15)
         
         self.write(self.BUS_MASTER,[39,0,0,1]) #send sync
-        self.write(self.BUS_SLAVE,[77,0,1,0]) #set buffer to 0 on slave
+        if self.dualBoard:
+            self.write(self.BUS_SLAVE,[77,0,1,0]) #set buffer to 0 on slave
         self.write(self.BUS_MASTER,[77,0,1,0]) #set buffer to 0 
         self.write(self.BUS_MASTER,[39,0,0,0]) #release sync
         self.write(self.BUS_MASTER,[39,0,0,1]) #send sync
-        self.write(self.BUS_SLAVE,[126,0,0,1]) #reset event counter/timestamp on slave
+        if self.dualBoard:
+            self.write(self.BUS_SLAVE,[126,0,0,1]) #reset event counter/timestamp on slave
         self.write(self.BUS_MASTER,[126,0,0,1]) #reset event counter/timestamp 
         self.write(self.BUS_MASTER,[39,0,0,0]) #release sync
         self.setReadoutBuffer(0)
@@ -198,7 +301,8 @@ class Nuphase():
     def dclkReset(self, sync=True):
         if sync:
             self.write(self.BUS_MASTER, [39,0,0,1]) #send sync
-            self.write(self.BUS_SLAVE, [55,0,0,1]) #send dclk reset pulse to slave
+            if self.dualBoard:
+                self.write(self.BUS_SLAVE, [55,0,0,1]) #send dclk reset pulse to slave
         self.write(self.BUS_MASTER, [55,0,0,1]) #send dclk reset pulse to master
         if sync:
             self.write(self.BUS_MASTER, [39,0,0,0]) #release sync
@@ -243,12 +347,16 @@ class Nuphase():
             self.write(self.BUS_MASTER,[39,0,0,0]) #release sync
 
     def getDataManagerStatus(self, verbose=True):
-        status_master = self.readRegister(self.BUS_MASTER, 7)
-        status_slave = self.readRegister(self.BUS_SLAVE,7)
-        self.buffers_full = [status_master[2] & 1, status_slave[2] & 1]
-        self.current_buffer = [(status_master[2] & 48) >> 4,(status_slave[2] & 48) >> 4]
-        self.buffer_flags = [status_master[3] & 15, status_slave[3] & 15]
-        self.last_trig_type = [(status_master[1] & 3), (status_slave[1] & 3)]
+        #per-bus lists, one entry for each board in the topology
+        status = [self.readRegister(bus, 7) for bus in self.topology.buses]
+        fields = [SCHEMA.decode({7 : board_status}, STATUS_FIELDS) for board_status in status]
+        self.buffers_full = [board_fields['buffers_full'] for board_fields in fields]
+        self.current_buffer = [board_fields['current_buffer'] for board_fields in fields]
+        self.buffer_flags = [board_fields['buffer_flags'] for board_fields in fields]
+        self.last_trig_type = [board_fields['last_trig_type'] for board_fields in fields]
+        status_master = status[0]
+        if self.dualBoard:
+            status_slave = status[1]
         
         if verbose: # and self.dualBoard:
             print 'status master:', status_master,
@@ -276,91 +384,35 @@ class Nuphase():
                 print 'slave:', self.last_trig_type[1]
             else:
                 print
-    def getMetaData(self, verbose=True):
+    def getMetaData(self, verbose=True, beam_power=False):
         '''UPDATE FOR BEACON'''
+        #beam_power=True also reads beam power registers 20..34 into metadata['master']['beam_power'] (uint32[15])
         metadata={}
-        metadata['master'] = {}  #master
+        metadata['master'] = SCHEMA.read(self, self.BUS_MASTER, METADATA_FIELDS + SCALER_FIELDS)
         metadata['slave'] = {}  #slave
-        evt_counter_master_lo = self.readRegister(self.BUS_MASTER, 10)
-        evt_counter_master_hi = self.readRegister(self.BUS_MASTER, 11)
-        if self.dualBoard:
-            evt_counter_slave_lo = self.readRegister(self.BUS_SLAVE, 10)
-            evt_counter_slave_hi = self.readRegister(self.BUS_SLAVE, 11)
-        trig_counter_master_lo = self.readRegister(self.BUS_MASTER, 12)
-        trig_counter_master_hi = self.readRegister(self.BUS_MASTER, 13)
-        if self.dualBoard:
-            trig_counter_slave_lo = self.readRegister(self.BUS_SLAVE, 12)
-            trig_counter_slave_hi = self.readRegister(self.BUS_SLAVE, 13)
-        trig_time_master_lo = self.readRegister(self.BUS_MASTER, 14)
-        trig_time_master_hi = self.readRegister(self.BUS_MASTER, 15)
-        if self.dualBoard:
-            trig_time_slave_lo = self.readRegister(self.BUS_SLAVE, 14)
-            trig_time_slave_hi = self.readRegister(self.BUS_SLAVE, 15)
-        deadtime_master = self.readRegister(self.BUS_MASTER,16)
         if self.dualBoard:
-            deadtime_slave = self.readRegister(self.BUS_SLAVE,16)
-        trig_info_master = self.readRegister(self.BUS_MASTER,17)
-        if self.dualBoard:
-            trig_info_slave = self.readRegister(self.BUS_SLAVE,17)
-        scaler_counter_master = self.readRegister(self.BUS_MASTER, 19)
-        trig_beam_power = []
-        for i in range(15):
-            trig_beam_power.append(self.readRegister(self.BUS_MASTER, 20+i) )
-        
-        metadata['master']['evt_count'] = evt_counter_master_hi[1] << 40 | evt_counter_master_hi[3] << 32 | evt_counter_master_hi[3] << 24 |\
-                                   evt_counter_master_lo[1] << 16 | evt_counter_master_lo [2] << 8 | evt_counter_master_lo[3]
-        metadata['master']['trig_count'] = trig_counter_master_hi[1] << 40 | trig_counter_master_hi[3] << 32 | trig_counter_master_hi[3] << 24 |\
-                                    trig_counter_master_lo[1] << 16 | trig_counter_master_lo [2] << 8 | trig_counter_master_lo[3]
-        metadata['master']['trig_time'] = trig_time_master_hi[1] << 40 | trig_time_master_hi[2] << 32 | trig_time_master_hi[3] << 24 |\
-                                   trig_time_master_lo[1] << 16 | trig_time_master_lo[2] << 8 | trig_time_master_lo[3]
-        metadata['master']['deadtime'] =  deadtime_master[1] << 16 | deadtime_master[2] << 8 | deadtime_master[3]
-        metadata['master']['last_beam_trig'] = (trig_info_master[2] & 0x7F) << 8 | trig_info_master[3]
-        metadata['master']['trig_type'] = (trig_info_master[1] & 0x01) << 1 | (trig_info_master[2] & 0x80) >> 7
-        metadata['master']['buffer_no'] = (trig_info_master[1] & 0xC0) >> 6
+            metadata['slave'] = SCHEMA.read(self, self.BUS_SLAVE, METADATA_FIELDS)
 
-        if self.dualBoard:
-            metadata['slave']['evt_count'] = evt_counter_slave_hi[1] << 40 | evt_counter_slave_hi[3] << 32 | evt_counter_slave_hi[3] << 24 |\
-                                             evt_counter_slave_lo[1] << 16 | evt_counter_slave_lo [2] << 8 | evt_counter_slave_lo[3]
-
-            metadata['slave']['trig_count'] = trig_counter_slave_hi[1] << 40 | trig_counter_slave_hi[3] << 32 | trig_counter_slave_hi[3] << 24 |\
-                                              trig_counter_slave_lo[1] << 16 | trig_counter_slave_lo [2] << 8 | trig_counter_slave_lo[3]
-            metadata['slave']['trig_time'] = trig_time_slave_hi[1] << 40 | trig_time_slave_hi[2] << 32 | trig_time_slave_hi[3] << 24 |\
-                                             trig_time_slave_lo[1] << 16 | trig_time_slave_lo[2] << 8 | trig_time_slave_lo[3]
-            metadata['slave']['deadtime'] =  deadtime_slave[1] << 16 | deadtime_slave[2] << 8 | deadtime_slave[3]
-            metadata['slave']['trig_type'] = (trig_info_slave[1] & 0x01) << 1 | (trig_info_slave[2] & 0x80) >> 7
-            metadata['slave']['buffer_no'] = (trig_info_slave[1] & 0xC0) >> 6
-
-        metadata['master']['scaler_slow'] = (scaler_counter_master[2] & 0x0F) << 8 | scaler_counter_master[3]
-        metadata['master']['scaler_fast'] = (scaler_counter_master[1] & 0xFF) << 4 | (scaler_counter_master[2] & 0xF0) >> 4
-
-        #metadata['master']['beam_power']=[]
-        #for i in range(15):
-        #    metadata['master']['beam_power'].append(trig_beam_power[i][1] << 16 | trig_beam_power[i][2] << 8 | trig_beam_power[i][3])
+        if beam_power:
+            trig_beam_power = numpy.array(self.readRegisters(self.BUS_MASTER, range(20, 35)), dtype=numpy.uint32)
+            metadata['master']['beam_power'] = SCHEMA.decode({20 : trig_beam_power}, ['beam_power'])['beam_power'].astype(numpy.uint32)
                                    
         return metadata
 
     def readSysEvent(self, address_start=1, address_stop=64, save=True, filename='test.dat'):
-        data_master = self.readBoardEvent(self.BUS_MASTER, address_start=address_start, address_stop=address_stop)
-        if self.dualBoard:
-            data_slave = self.readBoardEvent(self.BUS_SLAVE, channel_stop=3, address_start=address_start, address_stop=address_stop)
-
-        with open(filename, 'w') as f:
-            for i in range(len(data_master[0])):
-                for j in range(len(data_master)):
-                    f.write(str(data_master[j][i]))
-                    f.write('\t')
-                if self.dualBoard:
-                    for j in range(len(data_slave)):
-                        f.write(str(data_slave[j][i]))
-                        f.write('\t')
-                f.write('\n')
+        #returns (channels, samples) array, rows ordered board by board as in the topology
+        samples_per_address = 16
+        data = numpy.empty((self.topology.num_channels, (address_stop-address_start)*samples_per_address), dtype=numpy.int16)
+        for board in self.topology.boards:
+            offset = self.topology.channel_offset[board.bus]
+            data[offset:offset+board.num_channels] = self.readBoardEvent(board.bus, channel_stop=board.num_channels-1,
+                                                                         address_start=address_start, address_stop=address_stop)
 
-        if self.dualBoard:
-            return data_master+data_slave
-        else:
-            return data_master
+        if save:
+            numpy.savetxt(filename, data.T, fmt='%d', delimiter='\t', newline='\t\n')
+
+        return data
 
-                    
     def readBoardEvent(self, dev, channel_start=0, channel_stop=7, address_start=0, address_stop=64):
         data=[]
         for i in range(channel_start, channel_stop+1):
@@ -401,35 +453,30 @@ class Nuphase():
         return data
 
     def getCurrentAttenValues(self, verbose=False):
+        #one value per attenuated channel in the topology (topology.atten_channels order)
         current_atten_values = []
-        temp=self.readRegister(self.BUS_MASTER,50)
-        current_atten_values.extend([temp[3],temp[2],temp[1]])
-        temp=self.readRegister(self.BUS_MASTER,51)
-        current_atten_values.extend([temp[3],temp[2],temp[1]])
-        temp=self.readRegister(self.BUS_MASTER,52)
-        current_atten_values.extend([temp[3],temp[2]])
-
-        if self.dualBoard:
-            temp=self.readRegister(self.BUS_SLAVE,50)
-            current_atten_values.extend([temp[3],temp[2],temp[1]])
-            temp=self.readRegister(self.BUS_SLAVE,51)
-            current_atten_values.extend([temp[3]])
+        for board in self.topology.boards:
+            values = []
+            for temp in self.readRegisters(board.bus, range(50, 50 + (board.atten_channels + 2) // 3)):
+                values.extend([temp[3],temp[2],temp[1]])
+            current_atten_values.extend(values[:board.atten_channels])
             
         if verbose:
             print 'reading back attenuation values:', current_atten_values
         return current_atten_values
                                                                                 
     def setAttenValues(self, atten_values, readback=True):
-        self.write(self.BUS_MASTER, [50, atten_values[2] & 0xFF, atten_values[1] & 0xFF, atten_values[0] & 0xFF])
-        self.write(self.BUS_MASTER, [51, atten_values[5] & 0xFF, atten_values[4] & 0xFF, atten_values[3] & 0xFF])
-        self.write(self.BUS_MASTER, [52, 0x00, atten_values[7] & 0xFF, atten_values[6] & 0xFF])
-        self.write(self.BUS_MASTER, [53,0,0,0])
-
-        if self.dualBoard:
-            self.write(self.BUS_SLAVE, [50, 0x00, atten_values[9] & 0xFF, atten_values[8] & 0xFF])
-            #self.write(self.BUS_SLAVE, [50, atten_values[10] & 0xFF, atten_values[9] & 0xFF, atten_values[8] & 0xFF])
-            #self.write(self.BUS_SLAVE, [51, 0x00, 0x00, atten_values[11] & 0xFF])
-            self.write(self.BUS_SLAVE, [53,0,0,0])
+        #one value per attenuated channel in the topology (topology.atten_channels order, extra values
+        #are ignored). each board's values are packed 3 per register from 50 (first channel in byte 3),
+        #then latched with register 53
+        offset = 0
+        for board in self.topology.boards:
+            values = [int(value) & 0xFF for value in atten_values[offset:offset+board.atten_channels]]
+            offset = offset + board.atten_channels
+            for j in range(0, len(values), 3):
+                temp = values[j:j+3] + [0x00] * (3 - len(values[j:j+3]))
+                self.writeVerified(board.bus, [50 + j//3, temp[2], temp[1], temp[0]])
+            self.write(board.bus, [53,0,0,0])
             
         if readback:
             print 'set attenuation values to:', atten_values
@@ -459,10 +506,8 @@ class Nuphase():
         self.write(bus, [41,0,0,scaler_adr])
 
     def readSingleScaler(self, bus=0):
-        read_scaler_reg = self.readRegister(bus,3)
-        scaler_low = (read_scaler_reg[2] & 0x0F) << 8 | read_scaler_reg[3]
-        scaler_hi  = (read_scaler_reg[1] & 0xFF) << 4 | (read_scaler_reg[2] & 0xF0) >> 4
-        return scaler_low, scaler_hi
+        scaler = SCHEMA.decode({3 : self.readRegister(bus,3)}, ['scaler_low', 'scaler_hi'])
+        return scaler['scaler_low'], scaler['scaler_hi']
     
     def readScalers(self, bus=0):
         scaler_dict = {}
@@ -487,11 +532,7 @@ class Nuphase():
         scaler_dict[5].append(temp[1])
 
         #read the ext-trig input (i.e. PPS) latched timestamp
-        tmp=self.readRegister(bus, 44)
-        latched_timestamp = 0x000000000000 | (tmp[1] << 16) | (tmp[2] << 8) | tmp[3]
-        tmp=self.readRegister(bus, 45)
-        latched_timestamp = (tmp[1] << 40) | (tmp[2] << 32) | (tmp[3] << 24) | latched_timestamp
-        scaler_dict[6] = latched_timestamp
+        scaler_dict[6] = SCHEMA.read(self, bus, ['latched_timestamp'])['latched_timestamp']
         
         #loop through the rest of the beam scalers:
         for i in range(1,8):
@@ -520,14 +561,14 @@ class Nuphase():
     def enablePhasedTrigger(self, enable=True, readback=True, verification_mode=False, bus=0):
         readback_trig_reg = self.readRegister(bus, 82)
         if enable:
-            self.write(bus,[82, readback_trig_reg[1], readback_trig_reg[2], readback_trig_reg[3] | 0x01])
+            self.writeVerified(bus,[82, readback_trig_reg[1], readback_trig_reg[2], readback_trig_reg[3] | 0x01])
         else:
-            self.write(bus,[82, readback_trig_reg[1], readback_trig_reg[2], readback_trig_reg[3] & 0xFE])
+            self.writeVerified(bus,[82, readback_trig_reg[1], readback_trig_reg[2], readback_trig_reg[3] & 0xFE])
         #set verification mode:
         if verification_mode:
-            self.write(bus, [85,0,0,0x01])
+            self.writeVerified(bus, [85,0,0,0x01])
         else:
-            self.write(bus, [85,0,0,0x00])
+            self.writeVerified(bus, [85,0,0,0x00])
         ####
         if readback:
             readback_trig_reg = self.readRegister(bus, 82)
@@ -538,12 +579,9 @@ class Nuphase():
         
     def enablePhasedTriggerToDataManager(self, enable=True, readback=False):
         self.write(self.BUS_MASTER, [39,0,0,1])
-        if enable:
-            self.write(self.BUS_SLAVE, [84,0,0,1])
-            self.write(self.BUS_MASTER, [84,0,0,1])
-        else:
-            self.write(self.BUS_SLAVE, [84,0,0,0])
-            self.write(self.BUS_MASTER, [84,0,0,0])
+        if self.dualBoard:
+            self.write(self.BUS_SLAVE, [84,0,0,0x00 | enable])
+        self.write(self.BUS_MASTER, [84,0,0,0x00 | enable])
         self.write(self.BUS_MASTER, [39,0,0,0])
 
         if readback:
@@ -568,10 +606,10 @@ class Nuphase():
         thresh_hi = (threshold & 0x0F0000) >> 16
         thresh_mid = (threshold & 0x00FF00) >> 8
         thresh_lo = (threshold & 0x0000FF)
-        self.write(bus, [self.map['THRESHOLDS']+beam, thresh_hi, thresh_mid, thresh_lo])
+        self.writeVerified(bus, [self.map['THRESHOLDS']+beam, thresh_hi, thresh_mid, thresh_lo])
 
         if readback:
-            readback_thresh = self.readRegister(self.BUS_MASTER, self.map['THRESHOLDS']+beam)
+            readback_thresh = self.readRegister(bus, self.map['THRESHOLDS']+beam)
             print 'reading back threshold for beam', beam, ' Value is', readback_thresh
             return readback_thresh
         
@@ -1,5 +1,6 @@
 import numpy
 import nuphase
+import livetime
 import time
 from bf import *
 import json
@@ -28,6 +29,7 @@ d.bufferClear(15)
 cur_event = 0
 NEVENTS=1000
 all_metadata=[]
+monitor=livetime.LivetimeMonitor()
 while(cur_event < NEVENTS):
     time.sleep(0.1)
     #d.softwareTrigger()
@@ -39,6 +41,10 @@ while(cur_event < NEVENTS):
     flags = bf(d.buffer_flags[0])
     for i in range(4):
         if flags[i] == True:
+            monitor.bufferQueued(i)
+    for i in range(4):
+        if flags[i] == True:
+            monitor.startReadout(i)
             d.setReadoutBuffer(i)
             metadata = d.getMetaData()
             all_metadata.append(metadata)
@@ -46,10 +52,13 @@ while(cur_event < NEVENTS):
             cur_event = cur_event + 1
 
             d.bufferClear(1 << i)
+            monitor.endReadout(i, metadata)
             if metadata['slave']['evt_count'] != metadata['master']['evt_count']:
                 print 'EVENT COUNT MISMATCH!!!!!'
                 print '....'
+    monitor.publish()
 
 d.enablePhasedTriggerToDataManager(False)
+print monitor.publish(force=True)
 with open('metadata.json', 'w') as f:
     json.dump(all_metadata,f)
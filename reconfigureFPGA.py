@@ -5,7 +5,12 @@
 import nuphase
 import sys
 import time
-import tools.bf as bf
+from tools.poll import pollUntil
+from register_schema import SCHEMA
+
+RECONFIG_TIMEOUT  = 60.  #FPGA configuration from EPCQ normally takes well under this
+TRIG_COND_TIMEOUT = 5.
+RECONFIG_MIN_WAIT = 1.   #old image may still answer right after the trigger
 
 #remote update block accepted commands to fw
 ru_cmd_map = {
@@ -26,11 +31,14 @@ def enableRemoteFirmwareBlock(dev, bus, enable=False):
     dev.write(bus, [0x6E, 0x00, 0x00, (0x00 | enable)])
     dev.write(bus, [0x75, 0x00, 0x00, 0x00])
     
-def readRemoteConfigData(dev, bus, cmd):
+def readRemoteConfigData(dev, bus, cmd, raw=False):
+    #raw=True returns the (0x68, 0x69) readbacks for decoding with register_schema
     dev.write(bus, [0x75, 0x00, 0x00, (0x00 | (0x7 & cmd))])
     data_low = dev.readRegister(bus, address=0x68)
     data_hi  = dev.readRegister(bus, address=0x69)
     dev.write(bus, [0x74, 0x00, 0x00, 0x00])
+    if raw:
+        return data_low, data_hi
     return (data_low[2] << 8) | data_low[3], (data_hi[2] << 8) | data_hi[3]
 
 def readRemoteConfigStatus(dev, bus):
@@ -50,29 +58,76 @@ def writeRemoteConfiguration(dev, bus, cmd, value=0x00000000):
     dev.write(bus, [0x75, 0x00, 0x00, 0x00])
 
 def readTrigCondition(dev, bus, verbose=True):
-    cond = readRemoteConfigData(dev, bus, ru_cmd_map['TRIG_COND_READONLY'])[0]
-    bf_cond = bf.bf(cond) #trigger condition is lower 5 bits
+    data_low = readRemoteConfigData(dev, bus, ru_cmd_map['TRIG_COND_READONLY'], raw=True)[0]
+    cond = SCHEMA.decode({0x68 : data_low}, ['ru_trig_cond', 'ru_crc_error', 'ru_nstatus_error', 'ru_core_config',
+                                             'ru_nconfig', 'ru_watchdog_timeout']) #trigger condition is lower 5 bits
     if verbose:
         print '--------------'
-        print 'FPGA remote upgrade trigger condition:', cond, \
-            ' // bits:', bf_cond[0], bf_cond[1], bf_cond[2], bf_cond[3], bf_cond[4]
-    if bf_cond[0] == 1:
+        print 'FPGA remote upgrade trigger condition:', cond['ru_trig_cond'], \
+            ' // bits:', cond['ru_crc_error'], cond['ru_nstatus_error'], cond['ru_core_config'], \
+            cond['ru_nconfig'], cond['ru_watchdog_timeout']
+    if cond['ru_crc_error'] == 1:
         return ru_error['CRC_ERROR']
-    elif bf_cond[1] == 1:
+    elif cond['ru_nstatus_error'] == 1:
         return ru_error['NSTAT_ERROR']
-    elif bf_cond[4] == 1:
+    elif cond['ru_watchdog_timeout'] == 1:
         return ru_error['WATCHDOG_TIMEOUT']
-    elif bf_cond[2] == 1 or bf_cond[3] ==1:
+    elif cond['ru_core_config'] == 1 or cond['ru_nconfig'] ==1:
         if verbose:
             print 'FPGA trig conditions look good'
         return 0
     else:
-        print 'weird, no trig condition received'
+        if verbose:
+            print 'weird, no trig condition received'
         return -1
     
 def triggerReconfig(dev, bus):
     dev.write(bus, [0x75, 0x01, 0x00, 0x00])
 
+def floating(word):
+    #an unconfigured FPGA reads back all 0x00 or all 0xFF
+    return word is None or word[1:] in ([0x00,0x00,0x00], [0xFF,0xFF,0xFF])
+
+def imageResponds(dev, bus):
+    #firmware version / date and the remote update status register read back from a running image
+    return not (floating(dev.readRegister(bus, dev.map['FIRMWARE_VER'])) or
+                floating(dev.readRegister(bus, dev.map['FIRMWARE_DATE'])) or
+                readRemoteConfigStatus(dev, bus)[1:] == [0xFF,0xFF,0xFF])
+
+def waitForReconfig(dev, buses, timeout=RECONFIG_TIMEOUT, verbose=True):
+    #poll every rebooting board until the new image responds, then until its remote update block
+    #reports a trigger condition. returns {bus : (trig condition, seconds to respond)}; condition None on timeout
+    ready = {}
+    down = set()
+    def allReady():
+        elapsed = time.time() - start
+        for bus in buses:
+            if bus in ready:
+                continue
+            if not imageResponds(dev, bus):
+                down.add(bus)
+            elif bus in down or elapsed > RECONFIG_MIN_WAIT:
+                ready[bus] = elapsed
+        return len(ready) == len(buses)
+    start = time.time()
+    pollUntil(allReady, timeout, max_interval=0.25)
+    results = {}
+    for bus in buses:
+        if bus not in ready:
+            if verbose:
+                print 'bus', bus, ': no response after {:.0f} s'.format(timeout)
+            results[bus] = (None, None)
+            continue
+        enableRemoteFirmwareBlock(dev, bus, False)  #need to disable/re-enable remote blocks to get
+        enableRemoteFirmwareBlock(dev, bus, True)   #updated trig configuration status
+        trig_condition = pollUntil(lambda: readTrigCondition(dev, bus, verbose=False) != -1, TRIG_COND_TIMEOUT)[0]
+        trig_condition = readTrigCondition(dev, bus, verbose=verbose) if trig_condition is not None else -1
+        enableRemoteFirmwareBlock(dev, bus, False)
+        if verbose:
+            print 'bus', bus, ': new image responding after {:.1f} s'.format(ready[bus])
+        results[bus] = (trig_condition, ready[bus])
+    return results
+
 def reconfigure(dev, bus, AnF=1, epcq_address = 0x01000000,
                 watchdog_value=1024, watchdog_enable=1, verbose=True, exit_on_trig_error=False):
 
@@ -111,6 +166,7 @@ def reconfigure(dev, bus, AnF=1, epcq_address = 0x01000000,
 ###  run FPGA reconfiguration
 # to load application firmware image on MASTER board: $ ./reconfigureFPGA.py -a 1
 # to load application firmware image on SLAVE board: $ ./reconfigureFPGA.py -a 0
+# to reconfigure both boards at once: $ ./reconfigureFPGA.py -a 0 1
 #
 # program should return '0' if reconfiguration looks successful
 ###-----------------------------------------------------------------------
@@ -140,28 +196,29 @@ if __name__=='__main__':
         epcq_address = 0x00000000
         
 
-    if int(args[0]) == 0:
-        bus = 0
-    elif int(args[0]) == 1:
-        bus = 1
-    else:
-        print 'incorrect argument. Specify SPI bus 0 or 1 to reconfigure'
-        sys.exit("FAILURE")
+    buses = []
+    for arg in args:
+        if arg not in ['0', '1']:
+            print 'incorrect argument. Specify SPI bus 0 or 1 to reconfigure'
+            sys.exit("FAILURE")
+        if int(arg) not in buses:
+            buses.append(int(arg))
         
-    dev=nuphase.Nuphase()
-    enableRemoteFirmwareBlock(dev, bus, False)
-    enableRemoteFirmwareBlock(dev, bus, True)
-    retval=reconfigure(dev, bus, AnF=AnF, epcq_address=epcq_address)
+    dev=nuphase.Nuphase(dualBoard=(1 in buses))
+    for bus in buses:
+        enableRemoteFirmwareBlock(dev, bus, False)
+        enableRemoteFirmwareBlock(dev, bus, True)
+        retval=reconfigure(dev, bus, AnF=AnF, epcq_address=epcq_address)
     print '-------------'
     print 'reprogramming firmware...'
     print '-------------'
-    time.sleep(30)
-    enableRemoteFirmwareBlock(dev, bus, False)  #need to disable/re-enable remote blocks to get
-    enableRemoteFirmwareBlock(dev, bus, True)   #updated trig configuration status
-    retval=readTrigCondition(dev, bus)
-    enableRemoteFirmwareBlock(dev, bus, False)
-    time.sleep(5)
+    results = waitForReconfig(dev, buses)
     dev.identify()
-    time.sleep(1)
 
+    retval = 0
+    for bus in buses:
+        if results[bus][0] is None:
+            retval = 1
+        elif results[bus][0] != 0 and retval == 0:
+            retval = results[bus][0]
     sys.exit(retval)  #return 0 if successful (verify by reading back firmware version/date)
@@ -0,0 +1,99 @@
+#
+# firmware register fields, declared once.
+#
+# a field is a list of bit segments (register, readback byte, low bit, high bit), most
+# significant segment first; byte 0 of a readback is not part of the value. each field
+# is compiled to a single expression at import, so decoding does no per-access
+# bookkeeping. decoders take {register : readback} where a readback is either one
+# readRegister() result or a numpy array of many, shape (N, 4); arrays decode to arrays
+#
+import numpy
+
+NUM_BEAMS = 24 #phased-array beams, one trigger threshold register each
+
+def word24(register):
+    #the full 24 bit value of a register
+    return [(register, 1, 0, 7), (register, 2, 0, 7), (register, 3, 0, 7)]
+
+class Field():
+    def __init__(self, name, segments):
+        self.name = name
+        self.segments = segments
+        self.registers = sorted(set([segment[0] for segment in segments]))
+        self.width = sum([high - low + 1 for register, byte, low, high in segments])
+        terms = []
+        offset = self.width
+        for register, byte, low, high in segments:
+            offset = offset - (high - low + 1)
+            terms.append('(((r[%d][%d] >> %d) & 0x%x) << %d)' % (register, byte, low, (1 << (high - low + 1)) - 1, offset))
+        self.decoder = eval('lambda r: ' + ' | '.join(terms))
+
+class Schema():
+    def __init__(self, fields):
+        self.fields = dict([(field.name, field) for field in fields])
+
+    def registers(self, names):
+        #registers that must be read to decode the named fields
+        return sorted(set(sum([self.fields[name].registers for name in names], [])))
+
+    def decode(self, readbacks, names):
+        #returns {name : value}
+        prepared = {}
+        for register, readback in readbacks.items():
+            if isinstance(readback, numpy.ndarray) and readback.ndim > 1:
+                #(..., 4) -> (4, ...) so the compiled r[register][byte] picks a byte of every readback
+                prepared[register] = numpy.rollaxis(readback.astype(numpy.uint64), -1)
+            else:
+                prepared[register] = readback
+        return dict([(name, self.fields[name].decoder(prepared)) for name in names])
+
+    def read(self, dev, bus, names):
+        #read (one pipelined batch) and decode the named fields
+        registers = self.registers(names)
+        readback = dev.readRegisters(bus, registers)
+        return self.decode(dict(zip(registers, readback)), names)
+
+SCHEMA = Schema([
+    Field('firmware_id',          [(1, 1, 0, 7)]),
+    Field('firmware_major',       [(1, 3, 4, 7)]),
+    Field('firmware_minor',       [(1, 3, 0, 3)]),
+    Field('firmware_year',        [(2, 1, 0, 7), (2, 2, 4, 7)]),
+    Field('firmware_month',       [(2, 2, 0, 3)]),
+    Field('firmware_day',         [(2, 3, 0, 7)]),
+    Field('scaler_low',           [(3, 2, 0, 3), (3, 3, 0, 7)]),
+    Field('scaler_hi',            [(3, 1, 0, 7), (3, 2, 4, 7)]),
+    Field('dna',                  [(6, 2, 0, 7), (6, 3, 0, 7)] + word24(5) + word24(4)),
+    #data manager status
+    Field('last_trig_type',       [(7, 1, 0, 1)]),
+    Field('buffers_full',         [(7, 2, 0, 0)]),
+    Field('current_buffer',       [(7, 2, 4, 5)]),
+    Field('buffer_flags',         [(7, 3, 0, 3)]),
+    Field('data_valid',           [(8, 3, 4, 4)]),
+    #event metadata
+    Field('evt_count',            word24(11) + word24(10)),
+    Field('trig_count',           word24(13) + word24(12)),
+    Field('trig_time',            word24(15) + word24(14)),
+    Field('deadtime',             word24(16)),
+    Field('trig_type',            [(17, 1, 0, 0), (17, 2, 7, 7)]),
+    Field('buffer_no',            [(17, 1, 6, 7)]),
+    Field('last_beam_trig',       [(17, 2, 0, 6), (17, 3, 0, 7)]),
+    Field('scaler_fast',          [(19, 1, 0, 7), (19, 2, 4, 7)]),
+    Field('scaler_slow',          [(19, 2, 0, 3), (19, 3, 0, 7)]),
+    #registers 20..34 share this layout: decode their stacked readbacks as register 20
+    Field('beam_power',           word24(20)),
+    Field('latched_timestamp',    word24(45) + word24(44)),
+    #remote update block
+    Field('epcq_busy',            [(0x67, 3, 1, 1)]),
+    Field('epcq_done',            [(0x67, 3, 2, 2)]),
+    #0x68 after selecting the trigger condition (reconfigureFPGA.readRemoteConfigData)
+    Field('ru_trig_cond',         [(0x68, 2, 0, 7), (0x68, 3, 0, 7)]),
+    Field('ru_crc_error',         [(0x68, 3, 0, 0)]),
+    Field('ru_nstatus_error',     [(0x68, 3, 1, 1)]),
+    Field('ru_core_config',       [(0x68, 3, 2, 2)]),
+    Field('ru_nconfig',           [(0x68, 3, 3, 3)]),
+    Field('ru_watchdog_timeout',  [(0x68, 3, 4, 4)]),
+    ])
+
+STATUS_FIELDS = ['buffers_full', 'current_buffer', 'buffer_flags', 'last_trig_type']
+METADATA_FIELDS = ['evt_count', 'trig_count', 'trig_time', 'deadtime', 'last_beam_trig', 'trig_type', 'buffer_no']
+SCALER_FIELDS = ['scaler_slow', 'scaler_fast']
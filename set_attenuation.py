@@ -11,24 +11,28 @@
 # final values saved to file in output/
 # file columns are: channel, last written atten value, reversed last written atten value (=number of attenuation ticks),
 #                   last std deviation value of noise, target level of noise for channel
+#
+# the scan bisects the 7-bit attenuation range on all channels at once (~7 steps), estimating
+# the RMS from NUM_RMS_EVENTS buffered forced triggers per step
 
 import numpy
 import nuphase
-import time
+import noise
 import sys
 import json
 
-DEFINE_NUM_CHAN = 8
+MAX_ATTEN_TICKS = 127
+NUM_RMS_EVENTS = 4 #number of hardware buffers
 TARGET_NOISE_RMS_COUNTS_PHASED_BOARD = 3.9 #3.1 # 4.2
 TARGET_NOISE_RMS_COUNTS_RX_BOARD = 7.1
 atten_file = '/home/nuphase/nuphase_python/output/atten_values'
 
 def getRMS(data):
-    rms = []
-    for i in range(len(data)):
-        rms.append(round(numpy.std(data[i]),2))
-
-    return rms
+    #data: (channels, samples) or (events, channels, samples)
+    data = numpy.asarray(data, dtype=float)
+    if data.ndim == 2:
+        data = data[None,:,:]
+    return numpy.round(noise.noiseStats(data)['rms'], 2).tolist()
 
 def reverseBitsInByte(data):
     reversed_bytes=[]
@@ -37,6 +41,53 @@ def reverseBitsInByte(data):
 
     return reversed_bytes
 
+def measureRMS(dev, num_events=NUM_RMS_EVENTS):
+    #robust per-channel RMS pooled over a full set of buffered forced triggers
+    stats = noise.noiseStats(noise.acquireForcedEvents(dev, num_events))
+    return numpy.round(stats['rms'], 2)
+
+def calibrate(dev, target_rms, num_chan=None, num_events=NUM_RMS_EVENTS, verbose=True):
+    #find, per channel, the fewest attenuation ticks giving rms < target (127 if never reached).
+    #all channels are bisected concurrently: the answer always lies in [low, high]
+    #only channels with an attenuator in the board topology are scanned (the first num_chan of them)
+    channels = dev.topology.atten_channels[:num_chan]
+    target_rms = numpy.array(target_rms)[channels]
+    low = numpy.zeros(len(channels), dtype=int)
+    high = numpy.zeros(len(channels), dtype=int) + MAX_ATTEN_TICKS
+    rms_scan_dict = {}
+    iter_step = 0
+    while numpy.any(low < high):
+        mid = (low + high) // 2
+        dev.setAttenValues(reverseBitsInByte(mid.tolist()), readback=False)
+        rms = measureRMS(dev, num_events)[channels]
+        rms_scan_dict[iter_step] = (mid.tolist(), rms.tolist())
+        if verbose:
+            print iter_step, 'ticks:', mid.tolist(), 'rms:', rms.tolist()
+        quiet = rms < target_rms
+        active = low < high
+        high = numpy.where(active & quiet, mid, high)
+        low = numpy.where(active & ~quiet, mid+1, low)
+        iter_step = iter_step + 1
+
+    current_atten_values = reverseBitsInByte(high.tolist())
+    dev.setAttenValues(current_atten_values, readback=False)
+    rms = measureRMS(dev, num_events)[channels]
+    rms_scan_dict[iter_step] = (high.tolist(), rms.tolist())
+    return current_atten_values, high.tolist(), rms.tolist(), rms_scan_dict
+
+def targetRMS(topology, phased_rms, rx_rms):
+    #phased channels get the phased-board target, every other channel the receiver target
+    return [phased_rms if chan in topology.phased_channels else rx_rms for chan in range(topology.num_channels)]
+
+def saveAttenTable(filename, channels, atten_values, reversed_atten_values, rms, target_rms):
+    #one row per calibrated channel; channels are system channel ids (topology.atten_channels),
+    #target_rms is indexed by channel id
+    with open(filename, 'w') as f:
+        for j in range(len(atten_values)):
+            f.write(str(channels[j])+'\t'+str(atten_values[j])+'\t'+\
+                    str(reversed_atten_values[j])+'\t'+str(rms[j])+\
+                    '\t'+str(target_rms[channels[j]])+'\n')
+
 if __name__=='__main__':
 
     dev=nuphase.Nuphase()
@@ -66,55 +117,18 @@ if __name__=='__main__':
         TARGET_NOISE_RMS_COUNTS_RX_BOARD = float(sys.argv[2])
 
         
-    TARGET_NOISE_RMS_COUNTS = [TARGET_NOISE_RMS_COUNTS_PHASED_BOARD] * 8
-    TARGET_NOISE_RMS_COUNTS.extend([TARGET_NOISE_RMS_COUNTS_RX_BOARD]*4)
+    TARGET_NOISE_RMS_COUNTS = targetRMS(dev.topology, TARGET_NOISE_RMS_COUNTS_PHASED_BOARD, TARGET_NOISE_RMS_COUNTS_RX_BOARD)
     
     dev=nuphase.Nuphase()
     dev.boardInit()
-    set_atten_values = numpy.zeros(DEFINE_NUM_CHAN, dtype=int) 
-    set_atten_values = reverseBitsInByte(set_atten_values)
-    dev.setAttenValues(set_atten_values)
 
-    done=False
-    rms_scan_dict = {}
-    iter_step = 0
-    while(done==False):
-        dev.boardInit()
-        dev.softwareTrigger()
-        data=dev.readSysEvent()
-        current_atten_values = dev.getCurrentAttenValues()
-        reversed_current_atten_values = reverseBitsInByte(current_atten_values)
-        
-        rms=getRMS(data)
-        print 'rms:', rms
-        rms_scan_dict[iter_step] = (reversed_current_atten_values, rms)
-
-        check_good = 0
-        for i in range(DEFINE_NUM_CHAN):
-            if (rms[i] < TARGET_NOISE_RMS_COUNTS[i]) or (reversed_current_atten_values[i] == 127):
-                continue
-            else:
-                check_good = check_good + 1
-                reversed_current_atten_values[i] = reversed_current_atten_values[i] + 1
-       
-        current_atten_values = reverseBitsInByte(reversed_current_atten_values)
-        dev.setAttenValues(current_atten_values, readback=False)
-
-        print 'current atten values:', dev.getCurrentAttenValues()
-        print 'reversed bits:', reversed_current_atten_values
-        print '------'
-        if check_good == 0:
-            f = open(atten_file, 'w')
-            for j in range(DEFINE_NUM_CHAN):
-                f.write(str(j)+'\t'+str(current_atten_values[j])+'\t'+\
-                        str(reversed_current_atten_values[j])+'\t'+str(rms[j])+\
-                        '\t'+str(TARGET_NOISE_RMS_COUNTS[j])+'\n')
-            f.close()
-            done = True
-        time.sleep(0.1) #a bit of wait time
-        iter_step = iter_step + 1
+    current_atten_values, reversed_current_atten_values, rms, rms_scan_dict = calibrate(dev, TARGET_NOISE_RMS_COUNTS)
+    print 'rms:', rms
+    print 'current atten values:', dev.getCurrentAttenValues()
+    print 'reversed bits:', reversed_current_atten_values
+    print '------'
+    saveAttenTable(atten_file, dev.topology.atten_channels, current_atten_values, reversed_current_atten_values, rms, TARGET_NOISE_RMS_COUNTS)
 
     with open('/home/nuphase/nuphase_python/output/rms_scan.json', 'w') as f:
         json.dump(rms_scan_dict,f)
-    print done
     
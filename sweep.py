@@ -0,0 +1,240 @@
+#!/usr/bin/python
+#
+# multi-dimensional parameter sweep scheduler
+#
+# a plan is a sequence of points, each a dict of {parameter name : value}.
+# grid plans are walked in 'snake' order with the most expensive parameter
+# (in register writes) outermost, so neighbouring points differ in one
+# parameter and the costly ones change least often. only parameters that
+# changed since the previous point are written to the board.
+#
+# after a change the sweep waits for the every-second rate scaler to settle,
+# then scalers (and optionally forced-trigger events) are collected at every
+# point and saved as one columnar .npz file
+#
+# >> ./sweep.py out.npz threshold=16400:25401:200 pretrigger=4,6,8
+# >> ./sweep.py out.npz atten=0,8,16 threshold=...            same attenuation on every channel
+# >> ./sweep.py out.npz atten=0/0/4/4/0/0/4/4/0/0,8/8/...     per-channel vectors, '/'-separated
+#
+import numpy
+import nuphase
+import itertools
+import time
+from tools.poll import pollUntil
+
+ONE_HZ_PERIOD = 1.  #refresh period of the every-second scalers (s)
+
+SCALER_COLUMNS = {
+    0 : 'scaler_total',
+    1 : 'scaler_beams',
+    2 : 'scaler_1hz_total',
+    3 : 'scaler_1hz_beams',
+    4 : 'scaler_gated_total',
+    5 : 'scaler_gated_beams',
+    6 : 'pps_timestamp',
+    }
+
+def setThreshold(dev, value, num_beams=15):
+    #scalar value -> same threshold on every beam, sequence -> per-beam thresholds
+    if numpy.isscalar(value):
+        value = [value] * num_beams
+    for beam in range(len(value)):
+        dev.setBeamThresholds(value[beam], beam, readback=False)
+
+def setAtten(dev, value):
+    #scalar value -> same attenuation on every attenuated channel, sequence -> per-channel values
+    if numpy.isscalar(value):
+        value = [value] * len(dev.topology.atten_channels)
+    if len(value) != len(dev.topology.atten_channels):
+        raise ValueError('atten needs %d values, one per attenuated channel, got %d' % (len(dev.topology.atten_channels), len(value)))
+    dev.setAttenValues(value, readback=False)
+
+def setPreTrigger(dev, value):
+    dev.preTriggerWindow(value)
+
+def setExtGate(dev, value):
+    #value = None disables the external trigger input, otherwise enables it with this gate length
+    if value is None:
+        dev.externalTriggerInputConfig(enable=False)
+    else:
+        dev.externalTriggerInputConfig(enable=True, use_gate_gen=True, gate_value=value)
+
+#name : (setter, approximate number of register writes per change)
+PARAMETERS = {
+    'threshold'  : (setThreshold, 15),
+    'atten'      : (setAtten, 6),
+    'ext_gate'   : (setExtGate, 4),
+    'pretrigger' : (setPreTrigger, 2),
+    }
+
+def gridPlan(axes):
+    #axes = {name : list of values}. returns list of point dicts in snake order,
+    #most expensive parameter outermost
+    names = sorted(axes.keys(), key=lambda name: PARAMETERS[name][1], reverse=True)
+    plan = [{}]
+    for name in names:
+        new_plan = []
+        for i in range(len(plan)):
+            values = axes[name] if i % 2 == 0 else axes[name][::-1]
+            for value in values:
+                point = dict(plan[i])
+                point[name] = value
+                new_plan.append(point)
+        plan = new_plan
+    return plan
+
+def planCost(plan):
+    #number of register writes needed to walk a plan
+    cost = 0
+    last = {}
+    for point in plan:
+        for name in point:
+            if name not in last or not _equal(last[name], point[name]):
+                cost = cost + PARAMETERS[name][1]
+        last = point
+    return cost
+
+def adaptiveThresholdPlan(target_rate, low, high, tolerance=100, fixed=None, scaler_key=0):
+    #bisect a common beam threshold until the total scaler rate brackets target_rate
+    #to within 'tolerance' threshold units. returns a callable for Sweep.run()
+    state = {'low' : low, 'high' : high}
+    def nextPoint(history):
+        if len(history) > 0:
+            last = history[-1]
+            if last['scalers'][scaler_key] > target_rate:
+                state['low'] = last['point']['threshold']
+            else:
+                state['high'] = last['point']['threshold']
+        if state['high'] - state['low'] <= tolerance:
+            return None
+        point = dict(fixed or {})
+        point['threshold'] = (state['low'] + state['high']) // 2
+        return point
+    return nextPoint
+
+def _equal(a, b):
+    return numpy.array_equal(numpy.asarray(a), numpy.asarray(b))
+
+def oneHzRate(dev, bus=0):
+    #every-second total trigger scaler, the quickest rate readback to refresh after a change
+    dev.updateScalerValues(bus)
+    dev.setScalerOut(16, bus)
+    return dev.readSingleScaler(bus)[0]
+
+class Sweep():
+    def __init__(self, dev, settle_time=20., settle_updates=2, settle_tolerance=0.1, num_events=0, bus=0, verbose=True):
+        self.dev = dev
+        self.settle_time = settle_time              #longest wait for the rate to settle (s)
+        self.settle_updates = settle_updates        #successive scaler refreshes that must agree
+        self.settle_tolerance = settle_tolerance    #fractional spread allowed between them
+        self.num_events = num_events
+        self.bus = bus
+        self.verbose = verbose
+        self.current = {}
+        self.history = []
+
+    def apply(self, point):
+        changed = []
+        for name in point:
+            if name in self.current and _equal(self.current[name], point[name]):
+                continue
+            PARAMETERS[name][0](self.dev, point[name])
+            self.current[name] = point[name]
+            changed.append(name)
+        return changed
+
+    def settle(self):
+        #poll the every-second rate until settle_updates successive refreshes agree; the first
+        #refresh after the change may straddle it and is dropped. a refresh is a new value, or a
+        #full period since the last one (an unchanged rate). returns the seconds waited
+        last = [oneHzRate(self.dev, self.bus), time.time()]
+        updates = []
+        def settled():
+            rate = oneHzRate(self.dev, self.bus)
+            now = time.time()
+            if rate != last[0] or now - last[1] >= ONE_HZ_PERIOD:
+                updates.append(rate)
+                last[:] = [rate, now]
+            recent = updates[1:][-self.settle_updates:]
+            if len(recent) < self.settle_updates:
+                return False
+            return max(recent) - min(recent) <= self.settle_tolerance * max(max(recent), 1)
+        value, elapsed = pollUntil(settled, self.settle_time, interval=0.25)
+        if value is None and self.verbose:
+            print 'rate did not settle within', self.settle_time, 's, measuring anyway'
+        return elapsed
+
+    def measure(self, point):
+        changed = self.apply(point)
+        if len(changed) > 0:
+            self.settle()
+        result = {'point' : point, 'time' : time.time(), 'scalers' : self.dev.readScalers(bus=self.bus)}
+        if self.num_events > 0:
+            events = []
+            for i in range(self.num_events):
+                self.dev.eventInit()
+                self.dev.softwareTrigger()
+                events.append(self.dev.readSysEvent(save=False))
+            result['events'] = events
+        if self.verbose:
+            print len(self.history), point, 'wrote:', changed, 'total rate:', result['scalers'][0]
+        self.history.append(result)
+        return result
+
+    def run(self, plan):
+        #plan is a list of points, or a callable(history) returning the next point / None when done
+        if callable(plan):
+            point = plan(self.history)
+            while point is not None:
+                self.measure(point)
+                point = plan(self.history)
+        else:
+            for point in plan:
+                self.measure(point)
+        return self.history
+
+    def columns(self):
+        columns = {'time' : numpy.array([result['time'] for result in self.history])}
+        names = set(itertools.chain(*[result['point'].keys() for result in self.history]))
+        for name in names:
+            columns[name] = numpy.array([result['point'].get(name) for result in self.history])
+        for key in SCALER_COLUMNS:
+            columns[SCALER_COLUMNS[key]] = numpy.array([result['scalers'][key] for result in self.history])
+        if self.num_events > 0:
+            columns['events'] = numpy.array([result['events'] for result in self.history])
+        return columns
+
+    def save(self, filename):
+        numpy.savez(filename, **self.columns())
+
+def parseAxis(arg):
+    #name=start:stop:step  or  name=v0,v1,...  where a value may be a '/'-separated vector
+    #(one entry per beam for threshold, per attenuated channel for atten)
+    name, values = arg.split('=')
+    if name not in PARAMETERS:
+        raise ValueError('unknown sweep parameter %s, expected one of %s' % (name, sorted(PARAMETERS.keys())))
+    if ':' in values:
+        values = range(*[int(v) for v in values.split(':')])
+    else:
+        values = [[int(v) for v in value.split('/')] if '/' in value else int(value) for value in values.split(',')]
+    return name, values
+
+if __name__=='__main__':
+    import sys
+
+    if len(sys.argv) < 3:
+        print 'usage: ./sweep.py outfile.npz name=start:stop:step [name=v0,v1,...] [name=a0/a1/...,b0/b1/...]'
+        print 'parameters:', PARAMETERS.keys()
+        sys.exit(1)
+
+    axes = dict([parseAxis(arg) for arg in sys.argv[2:]])
+    plan = gridPlan(axes)
+    print len(plan), 'points,', planCost(plan), 'register writes'
+
+    d=nuphase.Nuphase()
+    d.boardInit()
+    d.enablePhasedTrigger(enable=True, readback=False)
+    sweep = Sweep(d)
+    sweep.run(plan)
+    sweep.save(sys.argv[1])
+    d.enablePhasedTrigger(enable=False, readback=False)
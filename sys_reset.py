@@ -1,14 +1,13 @@
 import nuphase
+import bringup
 import time
 
 sys=nuphase.Nuphase()
 sys.reset()
 print 'sending reset...'
-time.sleep(20)
+time.sleep(bringup.RESET_MIN_WAIT)
+#poll firmware/DNA and the data-valid flag rather than waiting a fixed 20 s
+bringup.waitForBoard(sys)
+bringup.waitForDataValid(sys)
 print sys.readRegister(1,8)
 print sys.readRegister(0,8)
-
-sys.boardInit()
-sys.softwareTrigger()
-sys.readSysEvent(save=False)
-sys.boardInit()
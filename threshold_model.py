@@ -0,0 +1,132 @@
+#!/usr/bin/python
+#
+# cached per-beam threshold-to-rate response model
+#
+# the beam trigger rate falls off ~exponentially with threshold above the noise
+# floor, so each beam is fit as:  log(rate) = p[0]*threshold + p[1]
+# fits are kept per board DNA + attenuation setting, so after a boot or an
+# attenuation change the thresholds can jump straight to a predicted value
+# for a target rate instead of scanning from scratch
+#
+# >> ./threshold_model.py                   print cached curves for this board
+# >> ./threshold_model.py 5.0               set thresholds predicted for 5.0 scaler counts/beam
+#
+import numpy
+import nuphase
+import json
+import os
+import time
+
+model_file = '/home/nuphase/nuphase_python/output/threshold_model.json'
+
+MAX_POINTS = 64   #most recent (threshold, rate) points kept per beam
+MIN_POINTS = 3    #need at least this many distinct non-zero points to fit
+MAX_THRESHOLD = 0x0FFFFF
+
+def modelKey(dna, atten_values):
+    return '{:x}'.format(dna)+':'+','.join([str(int(a)) for a in atten_values])
+
+def boardKey(dev, bus=0):
+    dna = dev.dna()[bus]
+    return modelKey(dna, dev.getCurrentAttenValues())
+
+class ThresholdModel():
+    def __init__(self, filename=model_file):
+        self.filename = filename
+        self.cache = {}
+        if os.path.isfile(filename):
+            with open(filename, 'r') as f:
+                self.cache = json.load(f)
+
+    def save(self):
+        tmp_filename = self.filename+'.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.cache, f)
+        os.rename(tmp_filename, self.filename)
+
+    def addPoints(self, key, thresholds, rates):
+        #thresholds and rates are per-beam lists (same ordering as readScalers()[1])
+        entry = self.cache.setdefault(key, {'updated' : 0, 'beams' : {}})
+        for beam in range(len(rates)):
+            beam_entry = entry['beams'].setdefault(str(beam), {'points' : [], 'fit' : None})
+            beam_entry['points'].append([int(thresholds[beam]), float(rates[beam])])
+            beam_entry['points'] = beam_entry['points'][-MAX_POINTS:]
+            beam_entry['fit'] = self.fitBeam(beam_entry['points'])
+        entry['updated'] = time.time()
+
+    def addScalers(self, key, thresholds, scalers):
+        #convenience for readScalers() output; key [1] holds the per-beam rates
+        self.addPoints(key, thresholds, scalers[1])
+
+    def fitBeam(self, points):
+        points = numpy.array(points, dtype=float)
+        #zero-count points carry no slope information on a log scale
+        points = points[points[:,1] > 0]
+        if len(numpy.unique(points[:,0])) < MIN_POINTS:
+            return None
+        p = numpy.polyfit(points[:,0], numpy.log(points[:,1]), 1)
+        #rate must fall with threshold, otherwise the fit is junk
+        if p[0] >= 0:
+            return None
+        return [float(p[0]), float(p[1])]
+
+    def predictRate(self, key, beam, threshold):
+        fit = self.getFit(key, beam)
+        if fit is None:
+            return None
+        return numpy.exp(fit[0]*threshold + fit[1])
+
+    def predictThreshold(self, key, beam, target_rate):
+        fit = self.getFit(key, beam)
+        if fit is None or target_rate <= 0:
+            return None
+        threshold = (numpy.log(target_rate) - fit[1]) / fit[0]
+        return int(numpy.clip(round(threshold), 0, MAX_THRESHOLD))
+
+    def predictThresholds(self, key, target_rate, num_beams=15):
+        return [self.predictThreshold(key, beam, target_rate) for beam in range(num_beams)]
+
+    def getFit(self, key, beam):
+        try:
+            return self.cache[key]['beams'][str(beam)]['fit']
+        except KeyError:
+            return None
+
+def recordScalers(dev, model, bus=0, key=None):
+    #add one scaler reading at the currently-loaded thresholds (e.g. from normal running)
+    if key is None:
+        key = boardKey(dev, bus)
+    scalers = dev.readScalers(bus=bus)
+    thresholds = dev.readAllThresholds(bus=bus)[:len(scalers[1])]
+    model.addScalers(key, thresholds, scalers)
+    return scalers
+
+def setThresholdsForRate(dev, target_rate, model=None, num_beams=15, bus=0, default_threshold=None):
+    #set each beam to the threshold predicted for target_rate
+    #beams without a usable fit are left alone (or set to default_threshold, if given)
+    #returns list of thresholds written (None where nothing was written)
+    if model is None:
+        model = ThresholdModel()
+    key = boardKey(dev, bus)
+    predicted = model.predictThresholds(key, target_rate, num_beams)
+    for beam in range(num_beams):
+        if predicted[beam] is None:
+            predicted[beam] = default_threshold
+        if predicted[beam] is not None:
+            dev.setBeamThresholds(predicted[beam], beam, readback=False, bus=bus)
+    return predicted
+
+if __name__=='__main__':
+    import sys
+
+    dev=nuphase.Nuphase()
+    model=ThresholdModel()
+    key=boardKey(dev)
+
+    if len(sys.argv) > 1:
+        thresholds = setThresholdsForRate(dev, float(sys.argv[1]), model)
+        print 'set predicted thresholds:', thresholds
+    else:
+        print 'cached model for', key
+        for beam in range(15):
+            print beam, model.getFit(key, beam)
@@ -1,4 +1,5 @@
 import nuphase
+import threshold_model
 import time
 import json
 import sys
@@ -12,6 +13,9 @@ d.boardInit()
 d.enablePhasedTrigger(enable=True, verification_mode=False)
 d.readRegister(1,82)
 
+model=threshold_model.ThresholdModel()
+model_key=threshold_model.boardKey(d)
+
 info={}
 current_iter = 0
 
@@ -27,10 +31,12 @@ for i in range(THRESH_START, THRESH_END, THRESH_INC):
     info[current_iter] = {}
     info[current_iter]['thresh']  = i
     info[current_iter]['scalers'] = current_scalers
+    model.addScalers(model_key, [i]*len(current_scalers[1]), current_scalers)
     current_iter = current_iter + 1
     
 with open('thresh_scan_all.json', 'w') as f:
     json.dump(info,f)
+model.save()
 
 d.enablePhasedTrigger(enable=False)
     
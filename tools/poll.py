@@ -0,0 +1,90 @@
+import time
+
+#
+# Adaptive polling: check often at first, back off geometrically
+# up to max_interval, give up after timeout
+#
+
+def pollUntil(condition, timeout=30., interval=0.05, max_interval=1., backoff=1.5):
+    # returns (value, elapsed): value is the first true result of condition(),
+    # or None if the timeout expired first
+    start = time.time()
+    while True:
+        value = condition()
+        elapsed = time.time() - start
+        if value:
+            return value, elapsed
+        if elapsed + interval > timeout:
+            return None, elapsed
+        time.sleep(interval)
+        interval = min(interval * backoff, max_interval)
+
+#
+# Polling for a repeated operation of roughly fixed duration (flash erase, page program...):
+# learns the typical completion time, sleeps until just before it, then backs off
+# up to max_interval. completion times go into a log-binned histogram
+#
+
+HISTOGRAM_BINS = [1e-5 * 2**k for k in range(22)]  #10 us .. ~21 s upper bin edges
+
+class OperationTimer():
+    def __init__(self, name, expected, early=0.8, step=0.1, min_interval=1e-4, max_interval=1., backoff=1.5, alpha=0.2):
+        self.name = name
+        self.expected = expected    #running estimate of the completion time (s)
+        self.early = early          #first poll at early*expected
+        self.step = step            #then every step*expected, growing by backoff
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.alpha = alpha          #weight of the newest operation in the estimate
+        self.count = 0
+        self.polls = 0
+        self.total_time = 0.
+        self.histogram = [0] * (len(HISTOGRAM_BINS) + 1)
+
+    def wait(self, condition, timeout=None):
+        # returns the elapsed time once condition() is true, or None on timeout
+        start = time.time()
+        not_done = start    #last time condition() was false; completion lies after it
+        time.sleep(self.early * self.expected)
+        interval = min(max(self.step * self.expected, self.min_interval), self.max_interval)
+        polls = 0
+        while True:
+            polls = polls + 1
+            now = time.time()
+            if condition():
+                break
+            not_done = now
+            if timeout is not None and now - start > timeout:
+                return None
+            time.sleep(interval)
+            interval = min(interval * self.backoff, self.max_interval)
+        elapsed = time.time() - start
+        self.record(0.5 * (not_done - start + elapsed), polls)
+        return elapsed
+
+    def record(self, duration, polls=1):
+        self.expected = (1. - self.alpha) * self.expected + self.alpha * duration
+        self.count = self.count + 1
+        self.polls = self.polls + polls
+        self.total_time = self.total_time + duration
+        k = 0
+        while k < len(HISTOGRAM_BINS) and duration > HISTOGRAM_BINS[k]:
+            k = k + 1
+        self.histogram[k] = self.histogram[k] + 1
+
+    def summary(self):
+        if self.count == 0:
+            return '{}: no operations'.format(self.name)
+        return '{}: {:d} ops, mean {:.3g} s, expected {:.3g} s, {:.2f} polls/op'.format(
+            self.name, self.count, self.total_time / self.count, self.expected, float(self.polls) / self.count)
+
+    def histogramLines(self):
+        lines = []
+        low = 0.
+        for k in range(len(self.histogram)):
+            high = HISTOGRAM_BINS[k] if k < len(HISTOGRAM_BINS) else float('inf')
+            if self.histogram[k] > 0:
+                lines.append('  {:>9.3g} - {:<9.3g} s: {:d}'.format(low, high, self.histogram[k]))
+            low = high
+        return lines
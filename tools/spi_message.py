@@ -0,0 +1,87 @@
+import array
+import fcntl
+import os
+import numpy
+
+#
+# spidev multi-transfer messages (SPI_IOC_MESSAGE)
+#
+# every 4-byte word is its own spi_ioc_transfer with cs_change set, so chip select is
+# released between words exactly as between separate writebytes()/readbytes() calls and
+# the firmware latches one 32-bit word per CS frame. up to MAX_TRANSFERS words go to the
+# kernel in one ioctl instead of one syscall per word
+#
+
+#struct spi_ioc_transfer (linux/spi/spidev.h), 32 bytes
+TRANSFER_DTYPE = numpy.dtype([
+    ('tx_buf',           numpy.uint64),
+    ('rx_buf',           numpy.uint64),
+    ('len',              numpy.uint32),
+    ('speed_hz',         numpy.uint32), #0: the speed set on the device (SPI.msh)
+    ('delay_usecs',      numpy.uint16),
+    ('bits_per_word',    numpy.uint8),  #0: the device setting, 8
+    ('cs_change',        numpy.uint8),
+    ('tx_nbits',         numpy.uint8),
+    ('rx_nbits',         numpy.uint8),
+    ('word_delay_usecs', numpy.uint8),
+    ('pad',              numpy.uint8),
+    ])
+MAX_MESSAGE_BYTES = 4096 #spidev default bufsiz, limit on the summed length of one message
+#the ioctl size field is 14 bits wide: at most 511 transfers per message
+MAX_TRANSFERS = min(((1 << 14) - 1) // TRANSFER_DTYPE.itemsize, MAX_MESSAGE_BYTES // 4)
+
+def SPI_IOC_MESSAGE(num_transfers):
+    #_IOW('k', 0, char[num_transfers * sizeof(struct spi_ioc_transfer)])
+    return (1 << 30) | ((num_transfers * TRANSFER_DTYPE.itemsize) << 16) | (ord('k') << 8)
+
+def spidevFds():
+    #file descriptors of this process open on a spidev device, None without /proc
+    if not os.path.isdir('/proc/self/fd'):
+        return None
+    fds = set()
+    for fd in os.listdir('/proc/self/fd'):
+        try:
+            if os.readlink('/proc/self/fd/' + fd).startswith('/dev/spidev'):
+                fds.add(int(fd))
+        except OSError:
+            pass
+    return fds
+
+def openedFd(before):
+    #the one spidev descriptor opened since spidevFds() returned before, or None if it can't be told
+    if before is None:
+        return None
+    opened = spidevFds() - before
+    if len(opened) != 1:
+        return None
+    return opened.pop()
+
+class SpiMessage():
+    def __init__(self, fd, word_bytes=4):
+        self.fd = fd    #shared with the Adafruit_BBIO SPI object, which set mode and speed
+        self.word_bytes = word_bytes
+
+    def transfer(self, frames):
+        #frames: 4-byte words to write, or None for a word to read, each in its own CS frame.
+        #returns the words read, uint8 array shape (reads, word_bytes)
+        is_read = numpy.array([frame is None for frame in frames], dtype=bool)
+        readback = numpy.empty((is_read.sum(), self.word_bytes), dtype=numpy.uint8)
+        k = 0
+        for i in range(0, len(frames), MAX_TRANSFERS):
+            chunk = frames[i:i+MAX_TRANSFERS]
+            reads = is_read[i:i+len(chunk)]
+            #one buffer for the whole message: write words are sent from it, read words land in it
+            data = numpy.zeros((len(chunk), self.word_bytes), dtype=numpy.uint8)
+            if not reads.all():
+                data[~reads] = [frame for frame in chunk if frame is not None]
+            addresses = numpy.uint64(data.ctypes.data) + numpy.uint64(self.word_bytes) * numpy.arange(len(chunk), dtype=numpy.uint64)
+            transfers = numpy.zeros(len(chunk), dtype=TRANSFER_DTYPE)
+            transfers['tx_buf'] = numpy.where(reads, 0, addresses)
+            transfers['rx_buf'] = numpy.where(reads, addresses, 0)
+            transfers['len'] = self.word_bytes
+            transfers['cs_change'][:-1] = 1 #release CS after every word; the last one ends with the message
+            fcntl.ioctl(self.fd, SPI_IOC_MESSAGE(len(chunk)), array.array('B', transfers.tobytes()), True)
+            num_reads = reads.sum()
+            readback[k:k+num_reads] = data[reads]
+            k = k + num_reads
+        return readback
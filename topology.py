@@ -0,0 +1,66 @@
+#
+# station layout: which boards sit on which SPI bus, how many channels each
+# reads out, which of those feed the phased-array trigger, which have their
+# attenuation set and which ADCs are timing-aligned to the cal pulser.
+# the driver sizes its readout arrays from this and never touches absent buses
+#
+
+class Board():
+    def __init__(self, name, bus, num_channels, phased_channels=(), atten_channels=None, aligned_adcs=None):
+        self.name = name
+        self.bus = bus
+        self.num_channels = num_channels
+        self.phased_channels = list(phased_channels)  #board-local channel numbers
+        #attenuation is set on the first atten_channels channels (see Nuphase.setAttenValues)
+        self.atten_channels = num_channels if atten_channels is None else atten_channels
+        #the first aligned_adcs ADCs (2 channels each) see the cal pulse and get shift bytes
+        self.aligned_adcs = num_channels // 2 if aligned_adcs is None else aligned_adcs
+
+class Topology():
+    def __init__(self, name, boards):
+        self.name = name
+        self.boards = boards
+        self.buses = [board.bus for board in boards]
+        self.num_channels = sum([board.num_channels for board in boards])
+        #first system-wide channel index of each board, in readSysEvent() order
+        self.channel_offset = {}
+        offset = 0
+        for board in boards:
+            self.channel_offset[board.bus] = offset
+            offset = offset + board.num_channels
+        self.phased_channels = []
+        self.atten_channels = []
+        self.aligned_channels = []
+        for board in boards:
+            self.phased_channels.extend([self.channel_offset[board.bus] + ch for ch in board.phased_channels])
+            self.atten_channels.extend([self.channel_offset[board.bus] + ch for ch in range(board.atten_channels)])
+            self.aligned_channels.extend([self.channel_offset[board.bus] + ch for ch in range(2*board.aligned_adcs)])
+
+    def board(self, bus):
+        for board in self.boards:
+            if board.bus == bus:
+                return board
+        return None
+
+    def hasBus(self, bus):
+        return bus in self.buses
+
+    def adcs(self, shift_reg_base=56):
+        #(bus, shift register, (channel, channel)) per aligned ADC; two channels per ADC, system-wide channel numbering
+        adcs = []
+        for board in self.boards:
+            offset = self.channel_offset[board.bus]
+            for j in range(board.aligned_adcs):
+                adcs.append((board.bus, shift_reg_base+j, (offset+2*j, offset+2*j+1)))
+        return adcs
+
+#protoBEACON: master board only, all 8 channels phased
+BEACON = Topology('beacon', [Board('master', 0, 8, range(8))])
+#NuPhase: 8 phased channels on the master, 4 receiver channels read from the slave,
+#attenuation set and the cal pulse seen on the first 2 of them (one ADC)
+NUPHASE = Topology('nuphase', [Board('master', 0, 8, range(8)), Board('slave', 1, 4, atten_channels=2, aligned_adcs=1)])
+
+TOPOLOGIES = {
+    'beacon'  : BEACON,
+    'nuphase' : NUPHASE,
+    }
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#
+# offline emulation of the phased-array beam trigger
+#
+# takes recorded waveforms shaped (events, channels, samples), forms each beam
+# by delaying and summing the phased channels, squares and sums the beam over
+# overlapping windows (the firmware power sum), and predicts per-beam trigger
+# rates for any number of threshold vectors in one pass
+#
+# >> ./trigger_emulator.py event0.dat event1.dat ...    print predicted rates over a threshold range
+#
+import numpy
+from register_schema import NUM_BEAMS
+
+NUM_PHASED_CHAN = 8
+POWER_WINDOW = 16        #samples per power sum
+POWER_STEP = 8           #samples between successive power sums
+SAMPLE_RATE_HZ = 250.e6  #ADC sample rate, used to convert event length to livetime
+EVENT_CHUNK = 64         #events processed per vectorized block, bounds memory use
+
+def makeDelayTable(num_beams=NUM_BEAMS, num_chan=NUM_PHASED_CHAN, max_delay_per_chan=2.0):
+    #linear-phase steering: beam b delays channel c by c*slope[b] samples,
+    #slopes spread evenly over +/- max_delay_per_chan. shifted to be non-negative
+    slopes = numpy.linspace(-max_delay_per_chan, max_delay_per_chan, num_beams)
+    delays = numpy.round(slopes[:,None] * numpy.arange(num_chan)[None,:]).astype(int)
+    return delays - delays.min(axis=1)[:,None]
+
+def loadDelayTable(filename):
+    #text file, one row per beam, one column per phased channel
+    return numpy.atleast_2d(numpy.loadtxt(filename, dtype=int))
+
+def loadEvents(filenames):
+    #readSysEvent() text files: one row per sample, one column per channel
+    events = [numpy.loadtxt(filename).T for filename in filenames]
+    return numpy.array(events, dtype=numpy.float32)
+
+def subtractBaseline(data):
+    return data - numpy.median(data, axis=-1)[...,None]
+
+def beamPowers(data, delays, channels=None, window=POWER_WINDOW, step=POWER_STEP):
+    #returns windowed power sums, shape (events, beams, windows)
+    data = numpy.asarray(data, dtype=numpy.float32)
+    if channels is None:
+        channels = numpy.arange(delays.shape[1])
+    num_samples = data.shape[-1] - delays.max()
+    #index[beam, chan, t] = t + delay[beam, chan]
+    index = numpy.arange(num_samples)[None,None,:] + delays[:,:,None]
+    chan_index = numpy.asarray(channels)[None,:,None]
+
+    num_windows = (num_samples - window) // step + 1
+    powers = numpy.empty((data.shape[0], delays.shape[0], num_windows), dtype=numpy.float32)
+    for start in range(0, data.shape[0], EVENT_CHUNK):
+        block = data[start:start+EVENT_CHUNK]
+        beams = block[:, chan_index, index].sum(axis=2)  #(events, beams, samples)
+        cumulative = numpy.cumsum(beams*beams, axis=-1)
+        cumulative = numpy.concatenate((numpy.zeros(cumulative.shape[:-1]+(1,), dtype=cumulative.dtype), cumulative), axis=-1)
+        window_start = numpy.arange(num_windows) * step
+        powers[start:start+EVENT_CHUNK] = cumulative[...,window_start+window] - cumulative[...,window_start]
+    return powers
+
+def maxBeamPowers(data, delays, **kwargs):
+    #peak power sum per event and beam, shape (events, beams)
+    return beamPowers(data, delays, **kwargs).max(axis=-1)
+
+def triggerFractions(max_powers, thresholds):
+    #thresholds: (beams,) or (num_threshold_sets, beams)
+    #returns fraction of events that trigger each beam, shape (num_threshold_sets, beams)
+    thresholds = numpy.atleast_2d(thresholds)
+    return (max_powers[None,:,:] > thresholds[:,None,:]).mean(axis=1)
+
+def triggerRates(max_powers, thresholds, event_livetime):
+    #convert per-event trigger probability to a rate assuming Poisson arrivals:
+    #    P(trigger in event) = 1 - exp(-rate * event_livetime)
+    fractions = numpy.clip(triggerFractions(max_powers, thresholds), 0, 1.-1.e-12)
+    return -numpy.log1p(-fractions) / event_livetime
+
+def eventLivetime(num_samples, delays, sample_rate=SAMPLE_RATE_HZ):
+    return (num_samples - delays.max()) / sample_rate
+
+def predictRates(data, thresholds, delays=None, baseline=True, sample_rate=SAMPLE_RATE_HZ):
+    #one-shot helper: raw waveforms in, (num_threshold_sets, beams) rates in Hz out
+    data = numpy.asarray(data, dtype=numpy.float32)[:,:NUM_PHASED_CHAN]
+    if delays is None:
+        delays = makeDelayTable()
+    if baseline:
+        data = subtractBaseline(data)
+    max_powers = maxBeamPowers(data, delays)
+    return triggerRates(max_powers, thresholds, eventLivetime(data.shape[-1], delays, sample_rate))
+
+if __name__=='__main__':
+    import sys
+
+    if len(sys.argv) < 2:
+        print 'usage: ./trigger_emulator.py event0.dat [event1.dat ...]'
+        sys.exit(1)
+
+    data = loadEvents(sys.argv[1:])
+    delays = makeDelayTable()
+    scan = numpy.arange(16400, 25401, 200)
+    thresholds = numpy.repeat(scan[:,None], delays.shape[0], axis=1)
+    rates = predictRates(data, thresholds, delays)
+    for i in range(len(scan)):
+        print scan[i], numpy.round(rates[i], 2).tolist()
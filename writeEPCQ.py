@@ -4,23 +4,106 @@
 #   write new firmware image to NuPhase board EEPROM
 #----------------------------------------
 import nuphase
+import numpy
+import hashlib
+import json
+import mmap
+import os
 import sys
+import threading
 import time
 import reconfigureFPGA as reconfig
 import tools.bf as bf
+from tools.poll import OperationTimer
+from register_schema import SCHEMA
 
 directory = '/home/nuphase/firmware/'
 filename = directory+'masterFirmware-2018-2-22.rpd'
+manifest_file = '/home/nuphase/nuphase_python/output/epcq_manifest.json'
+journal_file  = '/home/nuphase/nuphase_python/output/epcq_journal_{}.json' #per board DNA
+manifest_lock = threading.Lock() #boards programmed in parallel share the manifest
+
+#EPCQ operation timing, learned as the image is written (starting guesses were the old fixed poll intervals).
+#one timer per board, so boards programmed in parallel never update the same estimate
+OPERATIONS = [
+    ('erase',   'sector erase', 0.2),
+    ('program', 'page program', 0.001),
+    ('read',    'block read',   0.1),
+    ]
+op_timers = {} #(operation, bus) : OperationTimer
+op_timers_lock = threading.Lock()
+
+class Reporter():
+    #console output of the sector programming path. boards programmed in parallel write through
+    #one lock: messages go out as whole lines above the status (progress) line, which is redrawn
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.status_line = ''
+
+    def message(self, *args):
+        with self.lock:
+            sys.stdout.write('\r' + ' ' * len(self.status_line) + '\r' + ' '.join([str(arg) for arg in args]) + '\n' +
+                             self.status_line + '\r')
+            sys.stdout.flush()
+
+    def status(self, line):
+        #replace the status line; '' clears it
+        with self.lock:
+            sys.stdout.write('\r' + line + ' ' * max(len(self.status_line) - len(line), 0) + '\r')
+            sys.stdout.flush()
+            self.status_line = line
+
+reporter = Reporter()
 
 FILEMAP_START_ADDR = 0x00000000
-FILEMAP_END_ADDR   = 0x00A331DA #this value needs to be updated for each new firmware version
+FILEMAP_END_ADDR   = 0x00A331DA #default only; the CLI finds the extent of each image with imageExtent()
 TARGET_START_ADDR  = 0x01000000 #address where application firmware image is stored - STATIC, DO NOT CHANGE!!
+PAGE_SIZE          = 256
+BLOCK_SIZE         = 16384 #bytes per readEPCQBlock
+SECTOR_SIZE        = 0x10000 #erase unit
+BLANK_PAGE         = bytearray([0xFF] * PAGE_SIZE) #erased state, no need to program
+
+#last confirmed block mode per bus. every command written to 0x72 is followed by a mode
+#change, so a cached mode means the register already holds [mode, no cmd]
+block_mode = {}
+
+def forgetMode(bus=None):
+    #call whenever the remote update block may have been reset (enable/disable, reconfigure)
+    if bus is None:
+        block_mode.clear()
+    else:
+        block_mode.pop(bus, None)
+
+def openImage(binary_rpd_file):
+    #read-only map of the whole .rpd file
+    return mmap.mmap(binary_rpd_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def imageExtent(filename, start_addr=FILEMAP_START_ADDR):
+    #file address of the last programmed (non-0xFF) byte; trailing erased padding is not written
+    with open(filename, 'rb') as binary_rpd_file:
+        rpd = openImage(binary_rpd_file)
+        programmed = numpy.flatnonzero(numpy.frombuffer(rpd[start_addr:], dtype=numpy.uint8) != 0xFF)
+        rpd.close()
+    if len(programmed) == 0:
+        return start_addr
+    return start_addr + int(programmed[-1])
 
 def setMode(dev, bus, mode):
     #mode = 1 to write to 256 byte firmware block FIFO
     #mode = 0 to read from block FIFO and cmd the ASMI_PARALLEL block
+    #the mode is read back only while it is unknown (after forgetMode); once confirmed,
+    #switches are written without a readback
+    if block_mode.get(bus) == mode:
+        return mode
     dev.write(bus, [0x72, 0x00, 0x00 | mode, 0x00]) 
+    if bus in block_mode:
+        block_mode[bus] = mode
+        return mode
     updated_mode = dev.readRegister(bus, 0x72)[2]
+    if updated_mode == mode:
+        block_mode[bus] = mode
+    else:
+        forgetMode(bus)
     return updated_mode
 
 def initWrite(dev, bus):
@@ -47,17 +130,18 @@ def readStatusReg(dev, bus, check_done=True):
     # read remote upgrade status register
     #     set check_done=True if you want to return EPCQ done/busy condition
     #
-    status = bf.bf(dev.readRegister(bus, 0x67)[3])
+    readback = dev.readRegister(bus, 0x67)
     if check_done:
-        if status[1] == True:
+        status = SCHEMA.decode({0x67 : readback}, ['epcq_busy', 'epcq_done'])
+        if status['epcq_busy'] == 1:
             return 'busy'
-        elif status[2] == True:
+        elif status['epcq_done'] == 1:
             return 'done'
         else:
             #print 'uh oh'
             return None
     else:
-        return status
+        return bf.bf(readback[3])
 
 def sectorClear(dev, bus, sector_addr):
     current_mode = setMode(dev, bus, 0)
@@ -66,8 +150,7 @@ def sectorClear(dev, bus, sector_addr):
     dev.write(bus, [0x73, 0x00, sector_addr_list[1], sector_addr_list[0]])
     dev.write(bus, [0x74, 0x00, sector_addr_list[3], sector_addr_list[2]])
     dev.write(bus, [0x72, 0x00, 0x00 | current_mode, 0x04]) #send sector-clear cmd
-    while(readStatusReg(dev, bus) != 'done'):
-        time.sleep(0.2)
+    opTimer('erase', bus).wait(lambda: readStatusReg(dev, bus) == 'done')
     current_mode = setMode(dev, bus, 1)
     return current_mode
 
@@ -82,64 +165,76 @@ def clearApplicationImage(dev, bus, hw_start_addr, image_end_addr):
     sys.stdout.write('   clearing sector address...0x{:x}  \n\n'.format(current_address-1))
     print 'DONE WITH EEPROM CLEAR'
 
+def blockReadWords():
+    #SPI words that clock one 16 KB block out of the readback RAM, 4 bytes (two 16 bit reads) per RAM address
+    words = []
+    for i in range(BLOCK_SIZE // 4):
+        words.append([0x79, 0x00, 0x00, 0x01])
+        words.append([0x78, (0xFF0000 & i) >> 16, (0x00FF00 & i) >> 8, 0x0000FF & i])
+        words.append([0x79, 0x00, 0x00, 0x03])
+        words.append([nuphase.Nuphase.map['SET_READ_REG'], 0x00, 0x00, 0x6A])
+        words.append([nuphase.Nuphase.map['SET_READ_REG'], 0x00, 0x00, 0x6B])
+    words.append([0x79, 0x00, 0x00, 0x00])
+    return words
+
+BLOCK_READ_WORDS = blockReadWords()
+
 def readEPCQBlock(dev, bus, addr, read_data=True):
     current_mode = setMode(dev, bus, 0)
     addr_list = makeAddrList(addr)
     dev.write(bus, [0x73, 0x00, addr_list[1], addr_list[0]])
     dev.write(bus, [0x74, 0x00, addr_list[3], addr_list[2]])
     dev.write(bus, [0x72, 0x00, 0x00 | current_mode, 0x01])
-    while(readStatusReg(dev, bus) != 'done'):
-        time.sleep(0.1)
+    opTimer('read', bus).wait(lambda: readStatusReg(dev, bus) == 'done')
     current_mode = setMode(dev, bus, 1)
     ##------------------------
-    ## save to list
+    ## save to uint8 array: [0x6A byte 3, 0x6A byte 2, 0x6B byte 3, 0x6B byte 2] per RAM address
     if read_data:
-        byte_list=[]
-        for i in range(4096):
-            dev.write(bus, [0x79, 0x00, 0x00, 0x01])
-            addr=[]
-            addr.append(int((0x0000FF & i)))
-            addr.append(int((0x00FF00 & i) >> 8))
-            addr.append(int((0xFF0000 & i) >> 16))
-            dev.write(bus, [0x78, addr[2], addr[1], addr[0]])
-            dev.write(bus, [0x79, 0x00, 0x00, 0x03])
-            dat = dev.readRegister(bus, 0x6A)
-            byte_list.extend((dat[3], dat[2]))
-            dat = dev.readRegister(bus, 0x6B)
-            byte_list.extend((dat[3], dat[2]))
-        dev.write(bus, [0x79, 0x00, 0x00, 0x00])
-        return byte_list
-
-def verifyEPCQContents(dev, bus, addr, file_byte_list):
-    epcq_byte_list = readEPCQBlock(dev, bus, addr)
-    if len(epcq_byte_list) != len(file_byte_list):
-        return None
-    byte_errors = 0
-    for i in range(len(file_byte_list)):
-        if epcq_byte_list[i] != file_byte_list[i]:
-            print 'MISMATCH FOUND (addr, loc, epcq value, file value): ', hex(addr), i, epcq_byte_list[i], file_byte_list[i], '   '
-            byte_errors = byte_errors + 1
+        readback = dev.pipeline(bus, BLOCK_READ_WORDS).reshape(BLOCK_SIZE // 4, 2, 4)
+        return readback[:,:,[3,2]].reshape(-1)
 
-    return byte_errors
+def fileOrder(page_bytes):
+    #flash readback order of raw file bytes: each 4-byte word reversed
+    return numpy.frombuffer(bytes(page_bytes), dtype=numpy.uint8).reshape(-1,4)[:,::-1].reshape(-1)
+
+def verifyEPCQContents(dev, bus, addr, file_bytes, verbose=True, max_print=8):
+    #compare a 16 KB block with the expected bytes (in readback order).
+    #returns array of mismatching byte offsets, or None if the lengths differ
+    epcq_bytes = readEPCQBlock(dev, bus, addr)
+    file_bytes = numpy.asarray(file_bytes, dtype=numpy.uint8)
+    if len(epcq_bytes) != len(file_bytes):
+        return None
+    mismatches = numpy.flatnonzero(epcq_bytes != file_bytes)
+    if verbose:
+        for i in mismatches[:max_print]:
+            print 'MISMATCH FOUND (addr, loc, epcq value, file value): ', hex(addr), i, epcq_bytes[i], file_bytes[i], '   '
+        if len(mismatches) > max_print:
+            print '...', len(mismatches) - max_print, 'more mismatches in block', hex(addr)
+    return mismatches
     
-def writeChunk(dev, bus, byte_list, sector_addr):
-    current_mode = setMode(dev, bus, 1)
-    dev.write(bus, [0x6F, 0x00, 0x00, 0x01]) #activate write enable to FIFO
+def fifoWords(byte_list):
+    #SPI words that load byte_list into the 256 byte FIFO, 4 words per 4 bytes
+    words = [[0x6F, 0x00, 0x00, 0x01]] #activate write enable to FIFO
     for i in range(0, len(byte_list), 4):
         #--------------------------
         ## Write to FIFO
         ## MSB --> first byte written
-        dev.write(bus, [0x70, 0x00, (0xFF & byte_list[i+2]), (0xFF & byte_list[i+3])]) 
-        dev.write(bus, [0x71, 0x00, (0xFF & byte_list[i]),   (0xFF & byte_list[i+1])])
-        dev.write(bus, [0x6F, 0x00, 0x00, 0x03]) # toggle write clock
-        dev.write(bus, [0x6F, 0x00, 0x00, 0x01]) # de-toggle write clock
+        words.append([0x70, 0x00, (0xFF & byte_list[i+2]), (0xFF & byte_list[i+3])])
+        words.append([0x71, 0x00, (0xFF & byte_list[i]),   (0xFF & byte_list[i+1])])
+        words.append([0x6F, 0x00, 0x00, 0x03]) # toggle write clock
+        words.append([0x6F, 0x00, 0x00, 0x01]) # de-toggle write clock
 
     #send last dummy byte-list (needed since FIFO empty flag apparently goes high on last entry, not *after* last entry read)
-    dev.write(bus, [0x70, 0x00, 0xFF, 0xFF])
-    dev.write(bus, [0x71, 0x00, 0xFF, 0xFF])
-    dev.write(bus, [0x6F, 0x00, 0x00, 0x03]) # toggle write clock
-    dev.write(bus, [0x6F, 0x00, 0x00, 0x01]) # de-toggle write clock   
-    dev.write(bus, [0x6F, 0x00, 0x00, 0x00])  # deactivate write enable
+    words.append([0x70, 0x00, 0xFF, 0xFF])
+    words.append([0x71, 0x00, 0xFF, 0xFF])
+    words.append([0x6F, 0x00, 0x00, 0x03]) # toggle write clock
+    words.append([0x6F, 0x00, 0x00, 0x01]) # de-toggle write clock
+    words.append([0x6F, 0x00, 0x00, 0x00]) # deactivate write enable
+    return words
+
+def writeChunk(dev, bus, byte_list, sector_addr):
+    current_mode = setMode(dev, bus, 1)
+    dev.writeBurst(bus, fifoWords(byte_list))
     #-----------------------
     ## Read bytes from FIFO, toggle write to EEPROM via ASMI_PARALLEL IP core
     current_mode = setMode(dev, bus, 0)
@@ -150,8 +245,7 @@ def writeChunk(dev, bus, byte_list, sector_addr):
     #toggle bulk write to EPCQ
     dev.write(bus, [0x72, 0x00, 0x00 | current_mode, 0x02])
     #dev.write(bus, [0x72, 0x00, 0x00 | current_mode, 0x00])
-    while(readStatusReg(dev, bus) != 'done'):
-        time.sleep(0.001)
+    opTimer('program', bus).wait(lambda: readStatusReg(dev, bus) == 'done')
     #status = readStatusReg(dev, bus, check_done=False)  
     #print 'after', status[4], status[3]
     current_mode = setMode(dev, bus, 1) #exit test mode
@@ -160,11 +254,13 @@ def writeFirmwareToEPCQ(dev, bus, filename, FILEMAP_START_ADDR, FILEMAP_END_ADDR
     ###
     # write the firmware image
     # [2017.11.3] added verification feature in which file contents are compared to EPCQ readback (increases program time ~3x)
+    #             readback is now pipelined (see readEPCQBlock) and compared block-wise
     ###
     start_time = time.time()
+    forgetMode(bus)
     with open(filename, 'rb') as binary_rpd_file:
-        binary_rpd_file.seek(0,2)  # Seek the end
-        num_bytes = binary_rpd_file.tell()
+        rpd = openImage(binary_rpd_file)
+        num_bytes = len(rpd)
         print '------------------------'
         print 'Reading raw programming file:', filename
         print 'Filesize:', num_bytes, 'bytes'
@@ -174,32 +270,33 @@ def writeFirmwareToEPCQ(dev, bus, filename, FILEMAP_START_ADDR, FILEMAP_END_ADDR
             print 'program readback verification: OFF'
         print '------------------------\n'
         
-        binary_rpd_file.seek(0,0) # go back to beginning of file
-        
         current_address = FILEMAP_START_ADDR
-        binary_rpd_file.seek(current_address) # go to start of firmware image in file
         current_byte_in_cycle = 0
-        verify_bytes = []
+        verify_bytes = bytearray()
+        byte_errors = 0
+        blank_pages = 0
         
         while (current_address < (FILEMAP_END_ADDR+256+1)):
             #--------------
             epcq_address   = current_address + TARGET_START_ADDR
-            read_256bytes  = binary_rpd_file.read(256)
-            write_256bytes = []
-            for i in range(256):
-                write_256bytes.append(ord(read_256bytes[i]))
-                if verify and ((i+1) % 4) == 0 and i > 0:
-                    verify_bytes.extend((write_256bytes[i], write_256bytes[i-1], write_256bytes[i-2], write_256bytes[i-3]))
+            write_256bytes = bytearray(rpd[current_address:current_address+PAGE_SIZE])
+            write_256bytes.extend([0xFF] * (PAGE_SIZE - len(write_256bytes))) #erased flash past end of file
+            if verify:
+                verify_bytes.extend(write_256bytes)
             #--------------
-            initWrite(dev, bus)
-            writeChunk(dev, bus, write_256bytes, epcq_address)
+            if write_256bytes == BLANK_PAGE:
+                blank_pages = blank_pages + 1 #already in the erased state after clearApplicationImage
+            else:
+                initWrite(dev, bus)
+                writeChunk(dev, bus, write_256bytes, epcq_address)
             #--------------
             if verify and (current_address - FILEMAP_START_ADDR + 256) % 16384 == 0 and current_address > 0:
                 verify_epcq_addr = current_address - (16384 - 256) + TARGET_START_ADDR
-                verify_retval = verifyEPCQContents(dev, bus, verify_epcq_addr, verify_bytes)
-                if verify_retval > 0:
-                    print 'byte mismatch(es) found:', verify_retval
-                verify_bytes=[]
+                verify_retval = verifyEPCQContents(dev, bus, verify_epcq_addr, fileOrder(verify_bytes))
+                if verify_retval is None or len(verify_retval) > 0:
+                    print 'byte mismatch(es) found:', None if verify_retval is None else len(verify_retval)
+                    byte_errors = byte_errors + (16384 if verify_retval is None else len(verify_retval))
+                verify_bytes = bytearray()
             #--------------
             now=time.time()
             _min, _sec = divmod((now-start_time), 60)
@@ -210,10 +307,279 @@ def writeFirmwareToEPCQ(dev, bus, filename, FILEMAP_START_ADDR, FILEMAP_END_ADDR
                 sys.stdout.flush()
             #--------------
             current_address = current_address + 256
+        rpd.close()
             
+    print blank_pages, 'blank pages skipped'
     sys.stdout.write('{:.2f} MB written to device; now at EEPROM address 0x{:x}. Time elapsed (min:sec) {:d}:{:.0f}         \n\n'.format((current_address-FILEMAP_START_ADDR-256)*1e-6, epcq_address, int(_min), _sec))               
     setMode(dev, bus, 0)
+    return byte_errors
+
+##------------------------
+## incremental update: erase / program / verify only the 64 KB sectors that changed
+##------------------------
+def loadImage(filename, start_addr=FILEMAP_START_ADDR, end_addr=None):
+    #image bytes start_addr..end_addr (default: imageExtent), padded with 0xFF (erased flash) to whole sectors
+    if end_addr is None:
+        end_addr = imageExtent(filename, start_addr)
+    with open(filename, 'rb') as binary_rpd_file:
+        rpd = openImage(binary_rpd_file)
+        image = bytearray(rpd[start_addr:end_addr+1])
+        rpd.close()
+    image.extend([0xFF] * (-len(image) % SECTOR_SIZE))
+    return image
+
+def imageHash(image):
+    return hashlib.sha1(bytes(image)).hexdigest()
+
+def sectorDigests(image):
+    return [hashlib.sha1(bytes(image[i:i+SECTOR_SIZE])).hexdigest() for i in range(0, len(image), SECTOR_SIZE)]
+
+def readSector(dev, bus, epcq_addr):
+    #sector contents in file byte order
+    data = numpy.empty(SECTOR_SIZE, dtype=numpy.uint8)
+    for i in range(0, SECTOR_SIZE, BLOCK_SIZE):
+        data[i:i+BLOCK_SIZE] = fileOrder(readEPCQBlock(dev, bus, epcq_addr+i))
+    return data
 
+def opTimer(operation, bus):
+    with op_timers_lock:
+        if (operation, bus) not in op_timers:
+            name, expected = [(name, expected) for op, name, expected in OPERATIONS if op == operation][0]
+            op_timers[(operation, bus)] = OperationTimer('bus {} {}'.format(bus, name), expected)
+        return op_timers[(operation, bus)]
+
+def printOpTiming(histograms=False):
+    with op_timers_lock:
+        timers = dict(op_timers)
+    for bus in sorted(set([bus for operation, bus in timers])):
+        for operation, name, expected in OPERATIONS:
+            if (operation, bus) not in timers:
+                continue
+            print timers[(operation, bus)].summary()
+            if histograms:
+                for line in timers[(operation, bus)].histogramLines():
+                    print line
+
+def boardKey(dev, bus):
+    #only touches this bus, so it is safe while the other board is being programmed
+    return '{:x}'.format(dev.dna([bus])[bus])
+
+def loadManifest(dev, bus, filename=manifest_file):
+    #sector digests of the last image written to this board, or None (also while a write is incomplete)
+    try:
+        with open(filename, 'r') as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return None
+    board = manifest.get(boardKey(dev, bus))
+    if board is None or not board.get('complete', True):
+        return None
+    return board['sectors']
+
+def manifestExtent(dev, bus, filename=manifest_file):
+    #number of sectors that may hold image data written to this board (complete or not), 0 if unknown
+    try:
+        with open(filename, 'r') as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return 0
+    board = manifest.get(boardKey(dev, bus), {})
+    return max(len(board.get('sectors', [])), board.get('extent', 0))
+
+def padToExtent(image, num_sectors):
+    #extend the image with erased sectors up to num_sectors, so programming it also erases the
+    #tail of a longer image written before
+    image.extend([0xFF] * max(num_sectors*SECTOR_SIZE - len(image), 0))
+    return image
+
+def invalidateManifest(dev, bus, num_sectors=0, filename=manifest_file):
+    #call before the first erase: until saveManifest() records the new image, the flash may hold
+    #anything, so the entry is marked incomplete and incremental updates compare against a readback.
+    #num_sectors: extent of the image about to be written, kept for manifestExtent()
+    key = boardKey(dev, bus)
+    with manifest_lock:
+        try:
+            with open(filename, 'r') as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            manifest = {}
+        board = manifest.setdefault(key, {'image' : None, 'sectors' : []})
+        board['extent'] = max(len(board['sectors']), board.get('extent', 0), num_sectors)
+        board['complete'] = False
+        board['time'] = time.time()
+        with open(filename+'.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.rename(filename+'.tmp', filename)
+
+def saveManifest(dev, bus, digests, image_name, filename=manifest_file):
+    key = boardKey(dev, bus)
+    with manifest_lock:
+        try:
+            with open(filename, 'r') as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            manifest = {}
+        manifest[key] = {'image' : image_name, 'time' : time.time(), 'sectors' : digests, 'complete' : True}
+        with open(filename+'.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.rename(filename+'.tmp', filename)
+
+def loadJournal(dev, bus, image_hash, start_addr=FILEMAP_START_ADDR):
+    #sector offsets already programmed (and verified) by an interrupted run of the same image on this board
+    try:
+        with open(journal_file.format(boardKey(dev, bus)), 'r') as f:
+            journal = json.load(f)
+    except (IOError, ValueError):
+        return []
+    if journal.get('image') != image_hash or journal.get('start_addr') != start_addr:
+        return []
+    return journal['done']
+
+def saveJournal(dev, bus, image_hash, done, start_addr=FILEMAP_START_ADDR):
+    filename = journal_file.format(boardKey(dev, bus))
+    with open(filename+'.tmp', 'w') as f:
+        json.dump({'image' : image_hash, 'start_addr' : start_addr, 'time' : time.time(), 'done' : done}, f)
+    os.rename(filename+'.tmp', filename)
+
+def clearJournal(dev, bus):
+    try:
+        os.remove(journal_file.format(boardKey(dev, bus)))
+    except OSError:
+        pass
+
+def sectorMatches(dev, bus, image, offset, start_addr=FILEMAP_START_ADDR):
+    flash = readSector(dev, bus, TARGET_START_ADDR + start_addr + offset)
+    return numpy.array_equal(flash, numpy.frombuffer(bytes(image[offset:offset+SECTOR_SIZE]), dtype=numpy.uint8))
+
+def changedSectors(dev, bus, image, installed=None, start_addr=FILEMAP_START_ADDR):
+    #image offsets of the sectors that differ from the flash. installed: sector digests of the image
+    #on record for this board (see loadManifest); if None the flash is read back and compared
+    changed = []
+    if installed is not None:
+        for k, digest in enumerate(sectorDigests(image)):
+            if k >= len(installed) or installed[k] != digest:
+                changed.append(k*SECTOR_SIZE)
+        return changed
+    for offset in range(0, len(image), SECTOR_SIZE):
+        if not sectorMatches(dev, bus, image, offset, start_addr):
+            changed.append(offset)
+    return changed
+
+def programSector(dev, bus, image, offset, start_addr=FILEMAP_START_ADDR, verify=True):
+    #erase and rewrite one sector. returns mismatch offsets within the sector (empty if not verified)
+    epcq_addr = TARGET_START_ADDR + start_addr + offset
+    sectorClear(dev, bus, epcq_addr)
+    for page in range(offset, offset+SECTOR_SIZE, PAGE_SIZE):
+        if image[page:page+PAGE_SIZE] == BLANK_PAGE:
+            continue
+        initWrite(dev, bus)
+        writeChunk(dev, bus, image[page:page+PAGE_SIZE], epcq_addr - offset + page)
+    if not verify:
+        return numpy.array([], dtype=int)
+    expected = numpy.frombuffer(bytes(image[offset:offset+SECTOR_SIZE]), dtype=numpy.uint8)
+    return numpy.flatnonzero(readSector(dev, bus, epcq_addr) != expected)
+
+def programSectors(dev, bus, image, offsets, start_addr=FILEMAP_START_ADDR, verify=True, resume=True, progress=None):
+    #erase / program / verify the given sectors, journaling each completed one so an interrupted run
+    #resumes at the first incomplete sector. returns {offset : mismatch offsets} for failed sectors.
+    #progress: dict updated with 'done' / 'total' / 'failed' sector counts instead of printing progress
+    start_time = time.time()
+    image_hash = imageHash(image)
+    done = loadJournal(dev, bus, image_hash, start_addr) if resume else []
+    if len(done) > 0:
+        #quick consistency check: the last sector journaled must still read back as written
+        if not sectorMatches(dev, bus, image, done[-1], start_addr):
+            done = done[:-1]
+        reporter.message('bus {:d} resuming: {:d} of {:d} sectors already done'.format(
+            bus, len([offset for offset in offsets if offset in done]), len(offsets)))
+    if len([offset for offset in offsets if offset not in done]) > 0:
+        invalidateManifest(dev, bus, len(image) // SECTOR_SIZE)
+    errors = {}
+    programmed = 0
+    if progress is not None:
+        progress.update({'done' : len([offset for offset in offsets if offset in done]), 'total' : len(offsets), 'failed' : 0})
+    for offset in offsets:
+        if offset in done:
+            continue
+        programmed = programmed + 1
+        _min, _sec = divmod(time.time()-start_time, 60)
+        if progress is None:
+            reporter.status('   programming sector address...0x{:x}. Time elapsed (min:sec) {:d}:{:.0f}'.format(
+                TARGET_START_ADDR + start_addr + offset, int(_min), _sec))
+        mismatches = programSector(dev, bus, image, offset, start_addr, verify)
+        if len(mismatches) > 0:
+            reporter.message('bus {:d} sector 0x{:x}: {:d} byte mismatch(es)'.format(bus, TARGET_START_ADDR + start_addr + offset, len(mismatches)))
+            errors[offset] = mismatches
+        else:
+            done.append(offset)
+            saveJournal(dev, bus, image_hash, done, start_addr)
+        if progress is not None:
+            progress['done'] = progress['done'] + (len(mismatches) == 0)
+            progress['failed'] = len(errors)
+    setMode(dev, bus, 0)
+    if len(errors) == 0:
+        clearJournal(dev, bus)
+    _min, _sec = divmod(time.time()-start_time, 60)
+    if progress is None:
+        reporter.status('')
+    reporter.message('bus {:d}: {:d} sector(s) programmed. Time elapsed (min:sec) {:d}:{:.0f}'.format(bus, programmed, int(_min), _sec))
+    return errors
+
+def programFirmware(dev, bus, filename, start_addr=FILEMAP_START_ADDR, end_addr=None, verify=True, resume=True,
+                    progress=None):
+    #sector-by-sector, resumable replacement for clearApplicationImage + writeFirmwareToEPCQ.
+    #sectors of a longer image written before (see manifestExtent) are erased too
+    forgetMode(bus)
+    image = padToExtent(loadImage(filename, start_addr, end_addr), manifestExtent(dev, bus))
+    errors = programSectors(dev, bus, image, range(0, len(image), SECTOR_SIZE), start_addr, verify, resume, progress)
+    if len(errors) == 0:
+        saveManifest(dev, bus, sectorDigests(image), filename)
+    return errors
+
+def updateFirmwareIncremental(dev, bus, filename, start_addr=FILEMAP_START_ADDR, end_addr=None,
+                              verify=True, use_manifest=True, resume=True, progress=None):
+    #returns (changed sector offsets, {offset : mismatch offsets} for sectors that failed verification)
+    forgetMode(bus)
+    image = padToExtent(loadImage(filename, start_addr, end_addr), manifestExtent(dev, bus))
+    installed = loadManifest(dev, bus) if use_manifest else None
+    reporter.message('bus', bus, ': comparing', len(image) // SECTOR_SIZE, 'sectors against', 'manifest' if installed is not None else 'flash readback')
+    changed = changedSectors(dev, bus, image, installed, start_addr)
+    reporter.message('bus', bus, ':', len(changed), 'sector(s) changed')
+    errors = programSectors(dev, bus, image, changed, start_addr, verify, resume, progress)
+    if len(errors) == 0:
+        saveManifest(dev, bus, sectorDigests(image), filename)
+    return changed, errors
+
+def programBoards(dev, buses, filename, start_addr=FILEMAP_START_ADDR, end_addr=None, verify=True,
+                  incremental=False, use_manifest=True, resume=True, interval=1.):
+    #program several boards at once, one worker thread per bus (each board has its own SPI controller
+    #and operation timers). returns {bus : {offset : mismatch offsets}}, None if the worker died
+    progress = dict([(bus, {'done' : 0, 'total' : 0, 'failed' : 0}) for bus in buses])
+    results = dict([(bus, None) for bus in buses])
+    def worker(bus):
+        if incremental:
+            results[bus] = updateFirmwareIncremental(dev, bus, filename, start_addr, end_addr, verify,
+                                                     use_manifest, resume, progress[bus])[1]
+        else:
+            results[bus] = programFirmware(dev, bus, filename, start_addr, end_addr, verify, resume, progress[bus])
+    start_time = time.time()
+    workers = [threading.Thread(target=worker, args=(bus,)) for bus in buses]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+    while any([thread.is_alive() for thread in workers]):
+        _min, _sec = divmod(time.time()-start_time, 60)
+        reporter.status('   ' + '   '.join(['bus {:d}: {:d}/{:d} sectors ({:d} failed)'.format(
+            bus, progress[bus]['done'], progress[bus]['total'], progress[bus]['failed']) for bus in buses]) +
+            '. Time elapsed (min:sec) {:d}:{:.0f}'.format(int(_min), _sec))
+        workers[[thread.is_alive() for thread in workers].index(True)].join(interval)
+    reporter.status('')
+    for bus in buses:
+        if results[bus] is None:
+            print 'bus', bus, ': programming did not complete'
+        else:
+            print 'bus', bus, ':', 'verified' if len(results[bus]) == 0 else '{:d} sector(s) failed verification'.format(len(results[bus]))
+    return results
 
 ###-----------------------------------------------------------------
 ### load new application firmware image
@@ -224,27 +590,64 @@ if __name__=='__main__':
     import sys
     from optparse import OptionParser
     parser = OptionParser()
+    parser.add_option("-i", "--incremental", action="store_true", dest="incremental", default=False,
+                      help="erase and program only the 64 KB sectors that differ from the installed image")
+    parser.add_option("-r", "--readback", action="store_false", dest="use_manifest", default=True,
+                      help="with -i, compare against a flash readback instead of the manifest")
+    parser.add_option("-e", "--end-addr", dest="end_addr", default=None,
+                      help="last image address in the file (hex); default: last non-0xFF byte")
+    parser.add_option("-n", "--no-resume", action="store_false", dest="resume", default=True,
+                      help="ignore the journal of an interrupted run and start over")
+    parser.add_option("-t", "--target", dest="target", default="master", choices=["master", "slave", "both"],
+                      help="board(s) to program: master, slave, or both in parallel")
+    parser.add_option("-l", "--legacy", action="store_true", dest="legacy", default=False,
+                      help="clear the whole image, then program it page by page (not resumable; boards one at a time)")
     (options, args) = parser.parse_args()
     
 
 
     
-    dev=nuphase.Nuphase()
-    bus = dev.BUS_MASTER
-    #bus = dev.BUS_SLAVE
+    if options.end_addr is None:
+        end_addr = imageExtent(filename)
+    else:
+        end_addr = int(options.end_addr, 16)
+    print 'image extent: 0x{:x}'.format(end_addr)
+
+    dev=nuphase.Nuphase(dualBoard=(options.target != 'master'))
+    bus = dev.BUS_SLAVE if options.target == 'slave' else dev.BUS_MASTER
+    buses = [dev.BUS_MASTER, dev.BUS_SLAVE] if options.target == 'both' else [bus]
     print '\n RUNNING REMOTE FIRMWARE IMAGE UPDATE '
-    reconfig.enableRemoteFirmwareBlock(dev, bus, False)
-    reconfig.enableRemoteFirmwareBlock(dev, bus, True)
-    print '\n***************************\n'
-    clearApplicationImage(dev, bus, TARGET_START_ADDR, FILEMAP_END_ADDR)
-    #dat = readEPCQBlock(dev, bus, TARGET_START_ADDR)
-    #for i in range(len(dat)):
-    #    if dat[i] != 0xFF:
-    #        print 'clear error', i, dat[i]
+    for target_bus in buses:
+        reconfig.enableRemoteFirmwareBlock(dev, target_bus, False)
+        reconfig.enableRemoteFirmwareBlock(dev, target_bus, True)
+        forgetMode(target_bus)
     print '\n***************************\n'
-    time.sleep(1)
-    writeFirmwareToEPCQ(dev,bus,filename,FILEMAP_START_ADDR, FILEMAP_END_ADDR)
-    reconfig.enableRemoteFirmwareBlock(dev,bus,False)
+    if len(buses) > 1 and not options.legacy:
+        programBoards(dev, buses, filename, end_addr=end_addr, incremental=options.incremental,
+                      use_manifest=options.use_manifest, resume=options.resume)
+    elif options.incremental:
+        updateFirmwareIncremental(dev, bus, filename, end_addr=end_addr, use_manifest=options.use_manifest,
+                                  resume=options.resume)
+    elif not options.legacy:
+        programFirmware(dev, bus, filename, end_addr=end_addr, resume=options.resume)
+    else:
+        #legacy path is sequential: one board after the other
+        for target_bus in buses:
+            #clear through the end of a longer image written before, too
+            clear_end_addr = max(end_addr, manifestExtent(dev, target_bus)*SECTOR_SIZE - 1)
+            invalidateManifest(dev, target_bus, (end_addr + SECTOR_SIZE) // SECTOR_SIZE)
+            clearApplicationImage(dev, target_bus, TARGET_START_ADDR, clear_end_addr)
+            #dat = readEPCQBlock(dev, target_bus, TARGET_START_ADDR)
+            #for i in range(len(dat)):
+            #    if dat[i] != 0xFF:
+            #        print 'clear error', i, dat[i]
+            print '\n***************************\n'
+            time.sleep(1)
+            if writeFirmwareToEPCQ(dev,target_bus,filename,FILEMAP_START_ADDR, end_addr) == 0:
+                saveManifest(dev, target_bus, sectorDigests(loadImage(filename, end_addr=end_addr)), filename)
+    for target_bus in buses:
+        reconfig.enableRemoteFirmwareBlock(dev,target_bus,False)
     print '***************************\n'
+    printOpTiming(histograms=True)
     print 'seemed to process successfully'
     